@@ -0,0 +1,157 @@
+"""
+Offline throughput benchmark of TweetCapture
+
+Runs captures of synthetic tweets served by `stand_in_server` for several
+pool sizes and prints captures per second, p50/p95/p99 latency of every
+capture stage and the peak memory of all Chrome processes.
+
+    python -m benchmarks.bench_capture --pool-sizes 1 2 4 --captures 20 --photos 2 --video
+
+`--media-only --media-api` measures the browserless media path instead.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from tweet_capture import STAGE_SECONDS, TweetCapture
+
+from .stand_in_server import start_server
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    index = min(len(values) - 1, max(0, round(q * len(values)) - 1))
+    return values[index]
+
+
+def chrome_rss():
+    """Total resident memory of all chrome and chromedriver processes, in bytes"""
+    total = 0
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as cmdline:
+                if b"chrome" not in cmdline.read():
+                    continue
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+class PeakMemory:
+    """Samples `chrome_rss` in a background thread and keeps the maximum"""
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__sample, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stopped.set()
+        self.thread.join()
+
+    def __sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, chrome_rss())
+
+
+async def run(base_url, pool_size, captures, args):
+    query = f"photos={args.photos}&video={int(args.video)}&delay={args.delay}"
+    tweet = TweetCapture(
+        mode=args.mode,
+        wait_time=args.wait_time,
+        pool_size=pool_size,
+        block_profile=args.block_profile,
+        spare_drivers=0,
+        media_api_url=f"{base_url}/tweet-result?{query}" if args.media_api else None,
+    )
+    stages = defaultdict(list)
+    observer = lambda value, labels: stages[labels.get("stage")].append(value)
+    STAGE_SECONDS.observers.append(observer)
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as root:
+
+        async def capture(i):
+            path = os.path.join(root, str(i))
+            os.makedirs(os.path.join(path, "media"))
+            await tweet.capture(
+                f"{base_url}/standin/status/{1000 + i}?{query}",
+                path,
+                os.path.join(path, "media"),
+                only_screenshot=args.screenshot_only,
+                only_media=args.media_only,
+            )
+
+        try:
+            await tweet.start()
+            # One untimed capture, so the browser launch isn't counted as throughput
+            await capture(-1)
+            stages.clear()
+            with PeakMemory() as memory:
+                start = time.perf_counter()
+                results = await asyncio.gather(
+                    *(capture(i) for i in range(captures)), return_exceptions=True
+                )
+                elapsed = time.perf_counter() - start
+            failures = sum(isinstance(result, Exception) for result in results)
+        finally:
+            STAGE_SECONDS.observers.remove(observer)
+            await tweet.stop()
+            tweet.quit()
+
+    print(f"\npool size {pool_size}: {captures} captures in {elapsed:.2f}s, "
+          f"{captures / elapsed:.2f} captures/s, {failures} failed, "
+          f"peak chrome RSS {memory.peak / 2**20:.0f} MiB")
+    print(f"  {'stage':<12}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for stage, values in sorted(stages.items()):
+        print(f"  {stage:<12}{len(values):>7}" + "".join(
+            f"{percentile(values, q):>9.3f}" for q in (0.5, 0.95, 0.99)
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark of TweetCapture")
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--captures", type=int, default=20, help="Captures per pool size")
+    parser.add_argument("--photos", type=int, default=2, help="Photos in every tweet")
+    parser.add_argument("--video", action="store_true", help="Attach a video to every tweet")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds the tweet API answer is held back")
+    parser.add_argument("--mode", type=int, default=3)
+    parser.add_argument("--wait-time", type=float, default=15)
+    parser.add_argument("--block-profile", default="default")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--screenshot-only", action="store_true")
+    group.add_argument("--media-only", action="store_true")
+    parser.add_argument(
+        "--media-api", action="store_true", help="Fetch media only captures from the stand-in embed endpoint"
+    )
+    args = parser.parse_args()
+
+    server = start_server()
+    host, port = server.server_address
+    base_url = f"http://{host}:{port}"
+    try:
+        for pool_size in args.pool_sizes:
+            asyncio.run(run(base_url, pool_size, args.captures, args))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
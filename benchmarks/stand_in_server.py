@@ -0,0 +1,208 @@
+"""
+A local stand-in for twitter.com
+
+Serves synthetic tweet pages with the DOM `TweetCapture.capture()` expects,
+the API answer the page's video lookup reads, photos and videos, so captures
+can be measured without touching the real site.
+
+    python -m benchmarks.stand_in_server --port 8321
+
+Tweet pages live at `/{user}/status/{tweet_id}`, query parameters of the page
+control its content: `photos` (number of photos), `video` (1 to attach a
+video), `verified` (1 for a verified author) and `delay` (seconds the API
+answer is held back, to simulate a slow site). The same parameters on
+`/tweet-result?id={tweet_id}` give the answer of the embed endpoint the
+browserless media path reads.
+"""
+import argparse
+import json
+import re
+import struct
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import parse_qs, urlparse
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Stand-in tweet</title>
+<style>
+body {{ margin: 0; font-family: sans-serif; background: #fff; }}
+article {{ width: 560px; padding: 12px; border: 1px solid #ddd; }}
+[data-testid=tweetPhoto] img {{ width: 100%; display: block; }}
+[data-testid=videoComponent] {{ width: 100%; height: 300px; background: #000; }}
+</style>
+</head>
+<body>
+<div><div><div>
+<div><nav>Sidebar</nav></div>
+<div><header>Header</header><main><div id="timeline"></div></main></div>
+</div></div></div>
+<script>
+fetch("/i/api/graphql/standin/TweetResultByRestId?id={tweet_id}&{query}")
+    .then(response => response.json())
+    .then(data => {{
+        const tweet = data.data.tweetResult.result;
+        const media = tweet.legacy.extended_entities.media.map(item => item.type === "photo"
+            ? `<div data-testid="tweetPhoto"><img src="${{item.media_url_https}}"></div>`
+            : `<div data-testid="videoComponent"><video poster="${{item.media_url_https}}"></video></div>`
+        ).join("");
+        const verified = tweet.verified ? '<svg data-testid="icon-verified"></svg>' : "";
+        document.getElementById("timeline").innerHTML = `
+            <article data-testid="tweet" dir="ltr">
+                <div>
+                    <div><span>@{user}</span>${{verified}}</div>
+                    <div>${{tweet.legacy.full_text}}</div>
+                    ${{media}}
+                    <div><a aria-describedby="id__time"><time>12:00 PM · Jan 1, 2024</time></a></div>
+                    <div role="group">12 Reposts 34 Likes</div>
+                    <div role="group" id="id__actions">Reply Repost Like</div>
+                </div>
+            </article>`;
+    }});
+</script>
+</body>
+</html>
+"""
+
+
+def make_png(width=640, height=480, seed=0):
+    """A solid colour PNG, built without any imaging library"""
+    color = bytes(((seed * 67) % 256, (seed * 131) % 256, (seed * 199) % 256))
+    raw = b"".join(b"\x00" + color * width for _ in range(height))
+
+    def chunk(kind, data):
+        return (
+            struct.pack(">I", len(data)) + kind + data
+            + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+        )
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+def tweet_result(base_url, user, tweet_id, photos, video, verified):
+    media = [
+        {
+            "type": "photo",
+            "media_url_https": f"{base_url}/media/{tweet_id}_{i}?format=png&name=small",
+        }
+        for i in range(photos)
+    ]
+    if video:
+        media.append({
+            "type": "video",
+            "media_url_https": f"{base_url}/media/{tweet_id}_poster?format=png&name=small",
+            "video_info": {
+                "variants": [
+                    {"content_type": "application/x-mpegURL", "url": f"{base_url}/video/{tweet_id}.m3u8"},
+                    {"content_type": "video/mp4", "bitrate": 256000, "url": f"{base_url}/video/{tweet_id}_low.mp4"},
+                    {"content_type": "video/mp4", "bitrate": 2176000, "url": f"{base_url}/video/{tweet_id}.mp4"},
+                ]
+            },
+        })
+    return {
+        "rest_id": str(tweet_id),
+        "verified": verified,
+        "core": {"user_results": {"result": {"legacy": {"screen_name": user}}}},
+        "legacy": {
+            "id_str": str(tweet_id),
+            "full_text": f"Stand-in tweet {tweet_id} with {photos} photos",
+            "extended_entities": {"media": media},
+        },
+    }
+
+
+def syndication_result(base_url, user, tweet_id, photos, video, verified):
+    """The tweet-result answer of the embed endpoint for the same synthetic tweet"""
+    result = tweet_result(base_url, user, tweet_id, photos, video, verified)
+    return {
+        "__typename": "Tweet",
+        "id_str": str(tweet_id),
+        "text": result["legacy"]["full_text"],
+        "user": {"screen_name": user, "is_blue_verified": verified},
+        "mediaDetails": result["legacy"]["extended_entities"]["media"],
+    }
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    video_size = 2 * 1024 * 1024
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        number = lambda name, default=0: int(query.get(name, [default])[0])
+        base_url = f"http://{self.headers.get('Host')}"
+
+        page = re.fullmatch(r"/(\w+)/status/(\d+)", url.path)
+        if page:
+            body = PAGE.format(user=page[1], tweet_id=page[2], query=url.query).encode()
+            return self.__send(body, "text/html; charset=utf-8")
+
+        if url.path.startswith("/i/api/graphql/"):
+            time.sleep(float(query.get("delay", [0])[0]))
+            result = tweet_result(
+                base_url,
+                "standin",
+                query["id"][0],
+                number("photos"),
+                number("video"),
+                bool(number("verified")),
+            )
+            body = json.dumps({"data": {"tweetResult": {"result": result}}}).encode()
+            return self.__send(body, "application/json")
+
+        if url.path == "/tweet-result":
+            time.sleep(float(query.get("delay", [0])[0]))
+            result = syndication_result(
+                base_url,
+                "standin",
+                query["id"][0],
+                number("photos"),
+                number("video"),
+                bool(number("verified")),
+            )
+            return self.__send(json.dumps(result).encode(), "application/json")
+
+        if url.path.startswith("/media/"):
+            seed = zlib.crc32(url.path.encode())
+            return self.__send(make_png(seed=seed), "image/png")
+
+        if url.path.startswith("/video/") and url.path.endswith(".mp4"):
+            return self.__send(b"\x00" * self.video_size, "video/mp4")
+
+        self.__send(b"Not found", "text/plain", status=404)
+
+    def __send(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(host="127.0.0.1", port=0):
+    """Starts the server in a background thread and returns it, see `server.server_address`"""
+    server = ThreadingHTTPServer((host, port), StandInHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8321)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), StandInHandler)
+    print(f"Serving stand-in tweets on http://{args.host}:{args.port}/standin/status/1?photos=2&video=1")
+    server.serve_forever()
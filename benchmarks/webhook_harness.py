@@ -0,0 +1,184 @@
+"""
+End-to-end latency of the bot in webhook mode, without Telegram
+
+Starts a fake Bot API server, runs `bot.py` in webhook mode against it, posts
+synthetic updates to the bot's webhook and measures the time until the bot
+calls the API with its reply.
+
+    python -m benchmarks.webhook_harness --updates 200 --concurrency 10 --text /help
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.parse import parse_qs
+
+from .bench_capture import percentile
+
+TOKEN = "123456:bench"
+SECRET = "bench-secret"
+
+
+class FakeBotApi(BaseHTTPRequestHandler):
+    """Answers every Bot API method with a plausible result and records the calls"""
+
+    protocol_version = "HTTP/1.1"
+    calls = []
+    lock = threading.Lock()
+    message_ids = count(1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        now = time.perf_counter()
+        method = self.path.rsplit("/", 1)[-1]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        params = self.__params(body)
+        chat_id = params.get("chat_id")
+        with self.lock:
+            self.calls.append((now, method, chat_id))
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method == "sendMediaGroup":
+            result = [self.__message(chat_id) for _ in json.loads(params.get("media", "[]"))]
+        elif method.startswith(("send", "edit", "copy", "forward")):
+            result = self.__message(chat_id, params.get("text", ""))
+        else:
+            result = True
+        self.__send({"ok": True, "result": result})
+
+    def __params(self, body):
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
+            return {k: str(v) for k, v in json.loads(body or b"{}").items()}
+        if content_type.startswith("multipart/form-data"):
+            fields = re.findall(rb'name="([^"]+)"\r\n\r\n(.*?)\r\n--', body, re.S)
+            return {k.decode(): v.decode(errors="replace") for k, v in fields}
+        return {k: v[0] for k, v in parse_qs(body.decode()).items()}
+
+    def __message(self, chat_id, text=""):
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id or 0), "type": "private"},
+            "text": text,
+        }
+
+    def __send(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_update(update_id, chat_id, text):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Bench", "username": f"bench{chat_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def wait_for_port(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"Nothing listens on {host}:{port} after {timeout} seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency of the bot in webhook mode")
+    parser.add_argument("--updates", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--text", default="/help", help="Text of every synthetic message")
+    parser.add_argument("--webhook-port", type=int, default=8443)
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for the replies")
+    args = parser.parse_args()
+
+    api = ThreadingHTTPServer(("127.0.0.1", 0), FakeBotApi)
+    api.daemon_threads = True
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{api.server_address[1]}"
+
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN=TOKEN,
+        TELEGRAM_BOT_AUTHOR=os.getenv("TELEGRAM_BOT_AUTHOR", "1"),
+        TELEGRAM_API_URL=api_url,
+        TELEGRAM_WEBHOOK_URL=f"http://127.0.0.1:{args.webhook_port}",
+        TELEGRAM_WEBHOOK_LISTEN="127.0.0.1",
+        TELEGRAM_WEBHOOK_PORT=str(args.webhook_port),
+        TELEGRAM_WEBHOOK_SECRET=SECRET,
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    bot = subprocess.Popen([sys.executable, "bot.py"], cwd=root, env=env)
+    try:
+        wait_for_port("127.0.0.1", args.webhook_port, 60)
+        webhook = f"http://127.0.0.1:{args.webhook_port}/{env.get('TELEGRAM_WEBHOOK_PATH', 'telegram')}"
+
+        sent = {}
+
+        def post(i):
+            chat_id = 10_000 + i
+            request = urllib.request.Request(
+                webhook,
+                data=json.dumps(make_update(i + 1, chat_id, args.text)).encode(),
+                headers={
+                    "Content-Type": "application/json",
+                    "X-Telegram-Bot-Api-Secret-Token": SECRET,
+                },
+            )
+            sent[str(chat_id)] = time.perf_counter()
+            urllib.request.urlopen(request, timeout=10).read()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            list(executor.map(post, range(args.updates)))
+
+        deadline = time.monotonic() + args.timeout
+        replies = {}
+        while time.monotonic() < deadline and len(replies) < len(sent):
+            with FakeBotApi.lock:
+                for at, method, chat_id in FakeBotApi.calls:
+                    if chat_id in sent and chat_id not in replies:
+                        replies[chat_id] = at
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+    finally:
+        bot.terminate()
+        bot.wait(timeout=30)
+        api.shutdown()
+
+    latencies = [replies[chat_id] - sent[chat_id] for chat_id in replies]
+    print(f"{len(replies)}/{len(sent)} updates answered in {elapsed:.2f}s, "
+          f"{len(replies) / elapsed:.1f} updates/s")
+    if latencies:
+        print("latency " + ", ".join(
+            f"p{int(q * 100)} {percentile(latencies, q) * 1000:.1f} ms" for q in (0.5, 0.95, 0.99)
+        ))
+
+
+if __name__ == "__main__":
+    main()
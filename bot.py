@@ -1,8 +1,7 @@
 import argparse
-from shutil import rmtree
 import os
-from os.path import exists
 import asyncio
+import time
 
 import re
 from telegram import (
@@ -10,6 +9,8 @@ from telegram import (
     InlineKeyboardMarkup,
     InputMediaPhoto,
     InputMediaVideo,
+    Message,
+    MessageEntity,
     Update,
 )
 from telegram.ext import (
@@ -21,14 +22,121 @@ from telegram.ext import (
     filters,
 )
 
-from tweet_capture import TweetCapture, BasicExceptionTC, get_logger
+from tweet_capture import (
+    TweetCapture,
+    ResultCache,
+    BasicExceptionTC,
+    Gauge,
+    STAGE_SECONDS,
+    get_logger,
+    metrics_registry,
+    read_logs,
+    set_log_context,
+)
+from bot_utils import (
+    ChatLocks,
+    ExpiryService,
+    JobScheduler,
+    SchedulerError,
+    SessionStore,
+    WorkerPool,
+    call_with_flood_retry,
+    format_stats,
+    monitor_loop_lag,
+    plan_album_update,
+    serve_metrics,
+)
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN') 
 AUTHOR_ID = int(os.getenv('TELEGRAM_BOT_AUTHOR'))
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # e.g. a local Bot API server
+# Webhook mode is used when TELEGRAM_WEBHOOK_URL is set, long polling otherwise
+WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('TELEGRAM_WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('TELEGRAM_WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = os.getenv('TELEGRAM_WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET') or None
+# The bot only handles these, anything else isn't even fetched
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+DRIVER_POOL_SIZE = int(os.getenv('TWEET_CAPTURE_DRIVERS', 1))
+CAPTURE_WORKERS = int(os.getenv('TWEET_CAPTURE_WORKERS', 0))  # 0 captures in the bot process
+SPARE_DRIVERS = int(os.getenv('TWEET_CAPTURE_SPARES', 1))  # warm browsers on standby
+DRIVER_MAX_USES = int(os.getenv('TWEET_CAPTURE_MAX_USES', 100))  # captures before a browser is recycled
+DRIVER_MAX_RSS_MB = int(os.getenv('TWEET_CAPTURE_MAX_RSS_MB', 1024))  # 0 disables the memory watchdog
+MEDIA_API_URL = os.getenv('TWEET_MEDIA_API_URL', 'https://cdn.syndication.twimg.com/tweet-result')  # empty always uses the browser
+BLOCK_PROFILE = os.getenv('TWEET_CAPTURE_BLOCKING', 'default')
+BLOCKED_URLS = [url for url in os.getenv('TWEET_CAPTURE_BLOCK_URLS', '').split(',') if url]
+MAX_QUEUE = int(os.getenv('TWEET_QUEUE_SIZE', 50))
+USER_CONCURRENCY = int(os.getenv('TWEET_USER_CONCURRENCY', 1))
+USER_RATE = int(os.getenv('TWEET_USER_RATE', 10))  # tweets per minute
+REQUEST_TTL = 3600  # Control messages are deleted after 1 hour
+SESSION_TTL = 2 * REQUEST_TTL  # Upper bound for requests the expiry never got
+SESSION_MAX = int(os.getenv('TWEET_SESSIONS_MAX', 5000))
+SESSIONS_PATH = os.getenv('TWEET_SESSIONS_PATH', 'sessions.json')  # empty keeps them in memory only
+EXPIRY_PATH = os.getenv('TWEET_EXPIRY_PATH', 'expiry.json')
+METRICS_HOST = os.getenv('TWEET_METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.getenv('TWEET_METRICS_PORT', 0))  # 0 disables the endpoint
+SCREENSHOT_FORMAT = os.getenv('TWEET_SCREENSHOT_FORMAT', 'jpeg')
+SCREENSHOT_QUALITY = int(os.getenv('TWEET_SCREENSHOT_QUALITY', 90))
+SCREENSHOT_MAX_BYTES = int(os.getenv('TWEET_SCREENSHOT_MAX_KB', 10 * 1024)) * 1024  # Telegram's photo limit
+# 'memory' keeps the captures on tmpfs instead of the working directory
+WORKSPACE = os.getenv('TWEET_WORKSPACE', 'disk')
+MEMORY_WORKSPACE_DIR = '/dev/shm/tweet_capture'
+CACHE_DIR = os.getenv('TWEET_CACHE_DIR', MEMORY_WORKSPACE_DIR if WORKSPACE == 'memory' else 'cache')
+CACHE_MAX_MB = int(os.getenv('TWEET_CACHE_MAX_MB', 512))
+CACHE_TTL = int(os.getenv('TWEET_CACHE_TTL', 24 * 3600))
 
 logger = get_logger(__name__)
 
+# The host may not continue another domain, e.g. fox.com
+TWEET_LINK = re.compile(
+    r"(?<![\w.-])(https?:\/\/)?(www\.)?(twitter\.com|x\.com)\/(?P<user_name>\w+)\/status(es)?\/(?P<tweet_id>\d+)(\S*)?"
+)
+LINK_TRAILING_PUNCTUATION = ".,;:!?)]}>'\"»”’"
+# Every tweet of a batch takes one job of the user's rate limit
+MAX_BATCH_LINKS = max(1, min(10, USER_RATE))
+ALBUM_SIZE = 10  # Telegram's limit of items in one media group
+
+PHOTO_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+VIDEO_EXTENSIONS = (".mp4", ".gif")
+
+MEDIA_LOCKS = ChatLocks()
+
 class TwitterFrameHandler:
+    def __init__(self):
+        # Created here and not in the class body: capture worker processes
+        # import this module again and must not open a second cache or pool
+        capture_options = dict(
+            pool_size=DRIVER_POOL_SIZE,
+            block_profile=BLOCK_PROFILE,
+            blocked_urls=BLOCKED_URLS,
+            spare_drivers=SPARE_DRIVERS,
+            max_driver_uses=DRIVER_MAX_USES,
+            max_driver_rss=DRIVER_MAX_RSS_MB * 1024 * 1024 or None,
+            media_api_url=MEDIA_API_URL or None,
+        )
+        screenshot_format = (SCREENSHOT_FORMAT, SCREENSHOT_QUALITY, SCREENSHOT_MAX_BYTES)
+        if CAPTURE_WORKERS > 0:
+            # Every worker process runs its own TweetCapture with DRIVER_POOL_SIZE drivers
+            self.tweet = WorkerPool(CAPTURE_WORKERS, capture_options, screenshot_format)
+        else:
+            self.tweet = TweetCapture(**capture_options)
+            self.tweet.set_screenshot_format(*screenshot_format)
+        self.cache = ResultCache(CACHE_DIR, max_bytes=CACHE_MAX_MB * 1024 * 1024, ttl=CACHE_TTL)
+        self.scheduler = JobScheduler(
+            workers=DRIVER_POOL_SIZE * max(1, CAPTURE_WORKERS),
+            max_queue=MAX_QUEUE,
+            user_concurrency=USER_CONCURRENCY,
+            user_rate=USER_RATE,
+        )
+        self.sessions = SessionStore(
+            ttl=SESSION_TTL,
+            max_size=SESSION_MAX,
+            path=SESSIONS_PATH or None,
+            on_evict=self.release_session,
+            on_load=self.restore_session,
+        )
+
     def __enter__(self):
         return self
 
@@ -36,21 +144,12 @@ class TwitterFrameHandler:
         loop = asyncio.get_event_loop()
         loop.stop()
         loop.close()
-        # Clean up: delete the screenshots files
-        for dir in os.listdir():
-            if dir.startswith('screenshots-'):
-                rmtree(dir)
         self.tweet.quit()
 
-    tweet = TweetCapture()
-
     # Parser settings
     class __TweetLinkType:
         def __init__(self, link):
-            m = re.match(
-                "^(https?:\/\/)?(www\.)?(twitter\.com|x\.com)\/(?P<user_name>\w+)\/status(es)?\/(?P<tweet_id>\d+)(\S*)?",
-                link,
-            )
+            m = TWEET_LINK.match(link)
             if m is None:
                 raise argparse.ArgumentTypeError("Invalid link")
             self.url = f"https://twitter.com/{m['user_name']}/status/{m['tweet_id']}"
@@ -81,47 +180,59 @@ class TwitterFrameHandler:
         "-s", "--screenshot-only", help="Save only screenshot", action="store_true"
     )
 
-    async def __download_tweet(self, update: Update, context: ContextTypes.DEFAULT_TYPE, args, control_message_id):
-        tweet = args.twitter_link
-        screenshot_path = f"screenshots-{tweet.id}"
-        media_path = f"{screenshot_path}/media"
-        context.user_data[control_message_id]["screenshot_path"] = screenshot_path
-        context.user_data[control_message_id]["tweet_url"] = tweet.url
+    async def __acquire_tweet(self, tweet, args, choices):
+        """Returns the cache entry with the capture of `tweet`, release it when done"""
+        only_screenshot, only_media = choices["screenshot"], choices["media"]
+        key = self.cache.make_key(tweet.id, args.mode, args.night, only_screenshot, only_media)
 
-        if not exists(screenshot_path):
-            os.makedirs(screenshot_path)
-        if not exists(media_path):
-            os.makedirs(media_path)
-
-        logger.info(f"Started processing {tweet.url}")
-
-        try:
-            info = await self.tweet.capture(
+        async def capture(path):
+            return await self.tweet.capture(
                 tweet.url,
-                screenshot_path,
-                media_path,
+                path,
+                os.path.join(path, "media"),
                 mode=args.mode,
                 night_mode=args.night,
-                only_screenshot=context.user_data[control_message_id]["choices"]["screenshot"],
-                only_media=context.user_data[control_message_id]["choices"]["media"],
+                only_screenshot=only_screenshot,
+                only_media=only_media,
             )
-            context.user_data[control_message_id]["tweet_info"] = info
+
+        # Requests for the same tweet share one capture, the cache keeps
+        # the files until every request holding them is deleted
+        return await self.cache.acquire(key, capture)
+
+    async def __download_tweet(self, update: Update, context: ContextTypes.DEFAULT_TYPE, args, session):
+        # Jobs run in the scheduler's tasks, so the request is tagged again here
+        set_log_context(update.update_id, update.effective_user.id)
+        tweet = args.twitter_link
+        session.tweet_url = tweet.url
+
+        logger.info(f"Started processing {tweet.url}")
+
+        try:
+            entry = await self.__acquire_tweet(tweet, args, session.choices)
+            self.__hold(session, [entry])
+            session.screenshot_path = entry.path
+            session.tweet_info = entry.tweet_info
             logger.info(f"Started sending answer to {update.effective_user.name}")
 
             # Send the media group (photos/videos)
-            await send_media_message(update, context, control_message_id=control_message_id)
-
-            # Schedule the deletion of the control message and media after 1 hour
-            asyncio.create_task(delete_media_after_delay(context, control_message_id=control_message_id))
+            await send_media_message(context, session)
+
+            # Schedule the deletion of the control message after 1 hour
+            self.expiry.schedule(
+                REQUEST_TTL,
+                {
+                    "chat_id": session.chat_id,
+                    "user_id": session.user_id,
+                    "control_message_id": session.control_message_id,
+                },
+            )
             try:
                 await context.bot.edit_message_text(
-                    chat_id=context.user_data[control_message_id]['chat_id'],
-                    message_id=control_message_id,
+                    chat_id=session.chat_id,
+                    message_id=session.control_message_id,
                     text="Tweet processed. You can modify your selection:",
-                    reply_markup=InlineKeyboardMarkup(build_keyboard(
-                            context, 
-                            context.user_data[control_message_id]["choices"]
-                        ))
+                    reply_markup=InlineKeyboardMarkup(build_keyboard(context, session.choices))
                 )
             except Exception as e:
                 logger.error(f"Failed to update control message: {e}")
@@ -130,6 +241,7 @@ class TwitterFrameHandler:
             logger.error(
                 f"Failed to process tweet, message = {tweet.url}", exc_info=True
             )
+            self.sessions.pop(session.control_message_id)
             await update.message.reply_text(
                 text=f"Failed to process tweet: {err}",
                 reply_to_message_id=update.message.message_id,
@@ -138,14 +250,23 @@ class TwitterFrameHandler:
         logger.info(f"Finished with {update.effective_user.name}")
 
     async def twitter_link_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        set_log_context(update.update_id, update.effective_user.id)
+        user_message = update.message.text or update.message.caption or ""
         logger.info(
-            f"Message from {update.effective_user.name} with message {update.message.text}"
+            f"Message from {update.effective_user.name} with message {user_message}"
         )
-        user_message = update.message.text
+        links = find_tweet_links(update.message)
+        if not links and update.message.text is None:
+            # Captioned photos and videos are only answered when they link a tweet
+            return
+
         try:
-            args, argv = self.parser.parse_known_args(user_message.split())
-            if argv:
-                raise argparse.ArgumentError(None, f"Unrecognized arguments: {argv}")
+            if links:
+                args = self.__parse_link_options(user_message, links)
+            else:
+                args, argv = self.parser.parse_known_args(user_message.split())
+                if argv:
+                    raise argparse.ArgumentError(None, f"Unrecognized arguments: {argv}")
         except argparse.ArgumentError as err:
             logger.error(
                 f"User entered the wrong arguments, message={user_message}", exc_info=True
@@ -155,6 +276,9 @@ class TwitterFrameHandler:
                 reply_to_message_id=update.message.message_id,
             )
             return
+        if len(links) > 1:
+            await self.__batch_handler(update, context, args, links)
+            return
 
         choices = {"screenshot": args.screenshot_only, "media": args.media_only, "censor": False}
         # Inform the user that processing has started
@@ -162,43 +286,295 @@ class TwitterFrameHandler:
             text="Processing your tweet...",
             reply_markup=InlineKeyboardMarkup(build_keyboard(context, choices))
         )
-        control_message_id = control_message.message_id
-        context.user_data[control_message_id] = {
-            "user_message_id": update.message.message_id,
-            "chat_id": update.message.chat_id,
-            "choices": choices
-        }
+        session = self.sessions.create(
+            control_message.message_id,
+            update.message.chat_id,
+            update.effective_user.id,
+            update.message.message_id,
+            choices,
+        )
 
-        asyncio.create_task(self.__download_tweet(update, context, args, control_message_id))
+        report_position = self.__position_reporter(
+            context, session, "your tweet", "Processing your tweet...",
+            lambda: InlineKeyboardMarkup(build_keyboard(context, choices)),
+        )
 
-    async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Send a message when the command /help is issued."""
-        await update.message.reply_text(self.parser.format_help())
+        try:
+            await self.scheduler.submit(
+                update.effective_user.id,
+                update.message.chat_id,
+                lambda: self.__download_tweet(update, context, args, session),
+                on_position=report_position,
+            )
+        except SchedulerError as err:
+            self.sessions.pop(session.control_message_id)
+            await context.bot.edit_message_text(
+                chat_id=update.message.chat_id,
+                message_id=session.control_message_id,
+                text=str(err),
+            )
 
+    async def __batch_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE, args, links):
+        """Captures every tweet linked in one message and answers with combined albums, `args` apply to all of them"""
+        tweets = [self.__TweetLinkType(link) for link in links]
+        # Captures running side by side, each one counts against the user's concurrency
+        slots = min(len(tweets), self.scheduler.user_concurrency, self.scheduler.workers)
 
-async def delete_media_after_delay(context: ContextTypes.DEFAULT_TYPE, control_message_id):
-    await asyncio.sleep(3600)  # Wait for 1 hour (3600 seconds)
-    # Delete the control message
-    user_data = context.user_data[control_message_id]
-    try:
-        await context.bot.delete_message(
-            chat_id=user_data["chat_id"],
-            message_id=control_message_id
+        choices = {"screenshot": args.screenshot_only, "media": args.media_only, "censor": False}
+        control_message = await update.message.reply_text(
+            text=f"Processing {len(tweets)} tweets..."
+        )
+        session = self.sessions.create(
+            control_message.message_id,
+            update.message.chat_id,
+            update.effective_user.id,
+            update.message.message_id,
+            choices,
+        )
+        report_position = self.__position_reporter(
+            context, session, "your batch", f"Processing {len(tweets)} tweets...", lambda: None
         )
-        rmtree(user_data["screenshot_path"])
-        context.user_data.pop(control_message_id, None)
-    except Exception as e:
-        logger.error(f"Failed to delete control message: {e}")
 
+        try:
+            await self.scheduler.submit(
+                update.effective_user.id,
+                update.message.chat_id,
+                lambda: self.__download_batch(update, context, args, tweets, session, slots),
+                on_position=report_position,
+                cost=len(tweets),
+                slots=slots,
+            )
+        except SchedulerError as err:
+            self.sessions.pop(session.control_message_id)
+            await context.bot.edit_message_text(
+                chat_id=update.message.chat_id,
+                message_id=session.control_message_id,
+                text=str(err),
+            )
+
+    async def __download_batch(self, update: Update, context: ContextTypes.DEFAULT_TYPE, args, tweets, session, slots):
+        set_log_context(update.update_id, update.effective_user.id)
+        choices = session.choices
+        chat_id = session.chat_id
+        control_message_id = session.control_message_id
+        processed = 0
+        semaphore = asyncio.Semaphore(max(1, slots))
+
+        logger.info(f"Started processing a batch of {len(tweets)} tweets")
+
+        async def capture(tweet):
+            nonlocal processed
+            try:
+                # At most `slots` captures run side by side, the scheduler holds as many for the batch
+                async with semaphore:
+                    entry = await self.__acquire_tweet(tweet, args, choices)
+            except BasicExceptionTC:
+                logger.error(f"Failed to process tweet, message = {tweet.url}", exc_info=True)
+                entry = None
+            processed += 1
+            try:
+                await context.bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=control_message_id,
+                    text=f"Processed {processed}/{len(tweets)} tweets...",
+                )
+            except Exception as e:
+                logger.error(f"Failed to update control message: {e}")
+            return entry
+
+        entries = await asyncio.gather(*(capture(tweet) for tweet in tweets))
+        self.__hold(session, [entry for entry in entries if entry is not None])
 
-async def send_media_message(update: Update, context: ContextTypes.DEFAULT_TYPE, control_message_id):
-    user_data = context.user_data.get(control_message_id)
-    if (user_data is None or "tweet_info" not in user_data):
+        media_items = []
+        for tweet, entry in zip(tweets, entries):
+            if entry is not None:
+                media_items.extend((tweet, item) for item in collect_media_items(entry.path, choices))
+
+        for i in range(0, len(media_items), ALBUM_SIZE):
+            chunk = media_items[i:i + ALBUM_SIZE]
+            urls = list(dict.fromkeys(tweet.url for tweet, _ in chunk))
+            media_group = await build_media_group([item for _, item in chunk], {}, choices["censor"])
+            try:
+                with STAGE_SECONDS.time(stage="send_media"):
+                    await call_with_flood_retry(
+                        context.bot.send_media_group,
+                        chat_id=chat_id,
+                        media=media_group,
+                        caption="Tweets:\n" + "\n".join(urls),
+                        reply_to_message_id=control_message_id,
+                    )
+            except Exception as e:
+                logger.error(f"Failed to send album: {e}")
+
+        failed = [tweet.url for tweet, entry in zip(tweets, entries) if entry is None]
+        text = f"Processed {len(tweets) - len(failed)}/{len(tweets)} tweets."
+        if failed:
+            text += "\nFailed to process:\n" + "\n".join(failed)
+        try:
+            await context.bot.edit_message_text(chat_id=chat_id, message_id=control_message_id, text=text)
+        except Exception as e:
+            logger.error(f"Failed to update control message: {e}")
+
+        self.expiry.schedule(
+            REQUEST_TTL,
+            {
+                "chat_id": chat_id,
+                "user_id": session.user_id,
+                "control_message_id": control_message_id,
+            },
+        )
+        logger.info(f"Finished with {update.effective_user.name}")
+
+    def __parse_link_options(self, user_message, links):
+        """
+        Parses the options of a message with tweet links, the links may be anywhere and other words are ignored
+
+        Raises argparse.ArgumentError for invalid options.
+        """
+        words = [word for word in user_message.split() if not TWEET_LINK.search(word)]
+        args, _ = self.parser.parse_known_args([links[0]] + words)
+        return args
+
+    def __position_reporter(self, context: ContextTypes.DEFAULT_TYPE, session, subject, processing_text, reply_markup):
+        """Returns the scheduler callback that shows the queue position on the control message"""
+        async def report_position(position):
+            if position > 0:
+                text = f"Bot is busy, {subject} is number {position} in the queue..."
+            elif session.queued:
+                text = processing_text
+            else:
+                return
+            session.queued = position > 0
+            await context.bot.edit_message_text(
+                chat_id=session.chat_id,
+                message_id=session.control_message_id,
+                text=text,
+                reply_markup=reply_markup(),
+            )
+
+        return report_position
+
+    def __hold(self, session, entries):
+        """Makes the session own the cache entries, they are released with it"""
+        session.cache_entries = entries
+        session.cache_keys = [entry.key for entry in entries]
+        # The session may have been evicted while its tweets were captured
+        if self.sessions.get(session.control_message_id) is not session:
+            self.release_session(session)
+
+    def release_session(self, session):
+        for entry in session.cache_entries:
+            self.cache.release(entry)
+        session.cache_entries = []
+
+    def restore_session(self, session):
+        """Takes the cache entries of a session loaded from disk again"""
+        entries = [self.cache.pin(key) for key in session.cache_keys]
+        session.cache_entries = [entry for entry in entries if entry is not None]
+
+    async def post_init(self, application: Application) -> None:
+        """Starts the background services once the event loop is running"""
+        self.application = application
+        if isinstance(self.tweet, WorkerPool):
+            self.tweet.start()
+        else:
+            # Launched in the background, the bot answers while the browsers start
+            self.browsers = asyncio.create_task(self.tweet.start())
+        # Loaded before the expiry service starts deleting the requests they belong to
+        self.sessions.start()
+        self.expiry = ExpiryService(self.expire_requests, EXPIRY_PATH)
+        self.expiry.start()
+        self.scheduler.start()
+
+        metrics_registry.register(Gauge(
+            "bot_queue_depth", "Tweets waiting in the job queue", function=lambda: self.scheduler.depth
+        ))
+        metrics_registry.register(Gauge(
+            "bot_pending_expirations", "Requests waiting to be deleted", function=lambda: len(self.expiry)
+        ))
+        metrics_registry.register(Gauge(
+            "bot_sessions", "Requests whose buttons still work", function=lambda: len(self.sessions)
+        ))
+        self.loop_lag = asyncio.create_task(monitor_loop_lag())
+        self.metrics_server = None
+        if METRICS_PORT:
+            self.metrics_server = await serve_metrics(METRICS_HOST, METRICS_PORT)
+
+    async def post_shutdown(self, application: Application) -> None:
+        await self.scheduler.stop()
+        await self.expiry.stop()
+        await self.sessions.stop()
+        # The loop is closed before __exit__, so the browsers and workers are stopped while it still runs
+        await self.tweet.stop()
+        if not isinstance(self.tweet, WorkerPool):
+            await asyncio.gather(self.browsers, return_exceptions=True)
+        self.loop_lag.cancel()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+
+    async def expire_requests(self, chat_id, items):
+        """Deletes the control messages of expired requests in one chat and frees their files"""
+        message_ids = [item["control_message_id"] for item in items]
+        try:
+            # Telegram deletes at most 100 messages per call
+            for i in range(0, len(message_ids), 100):
+                await self.application.bot.delete_messages(chat_id, message_ids[i:i + 100])
+        except Exception as e:
+            logger.error(f"Failed to delete control messages: {e}")
+
+        for item in items:
+            session = self.sessions.pop(item["control_message_id"])
+            if session is not None:
+                self.release_session(session)
+
+    async def button(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        session = self.sessions.get(query.message.message_id)
+        if session is None:
+            await query.answer("This request has expired, send the link again.")
+            return
+        await query.answer()
+
+        choice = query.data
+        choices = session.choices
+
+        if choice == "censor":
+            choices["censor"] = not choices["censor"]
+        elif choice == "media":
+            choices["media"] = not choices["media"]
+            if choices["media"]:
+                choices["screenshot"] = False  # Deselect screenshot if media is selected
+        elif choice == "screenshot":
+            choices["screenshot"] = not choices["screenshot"]
+            if choices["screenshot"]:
+                choices["media"] = False  # Deselect media if screenshot is selected
+
+        # Update the buttons in the existing message
+        try:
+            await context.bot.edit_message_reply_markup(
+                chat_id=session.chat_id,
+                message_id=session.control_message_id,
+                reply_markup=InlineKeyboardMarkup(build_keyboard(context, choices))
+            )
+        except Exception as e:
+            logger.error(f"Error updating buttons: {e}")
+
+        # Update the message with the current choices
+        await send_media_message(context, session)
+
+    async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Send a message when the command /help is issued."""
+        await update.message.reply_text(self.parser.format_help())
+
+
+async def send_media_message(context: ContextTypes.DEFAULT_TYPE, session):
+    # Nothing captured yet, or the capture left the cache while the bot was down
+    if session.tweet_info is None or not os.path.isdir(session.screenshot_path):
         return
 
-    tweet_url = user_data["tweet_url"]
+    tweet_url = session.tweet_url
 
-    choices = user_data["choices"]
+    choices = session.choices
     if choices["screenshot"]:
         caption = f"Screenshot of {tweet_url}"
     elif choices["media"]:
@@ -206,60 +582,179 @@ async def send_media_message(update: Update, context: ContextTypes.DEFAULT_TYPE,
     else:
         caption = f"Tweet {tweet_url}"
 
-    if "TB" in user_data["tweet_info"]:
+    if "TB" in session.tweet_info:
         caption = (
             "WARNING, the tweet contains the opinion of a Twitter Blue user\n\n"
             + caption
         )
 
-    media_group = []
-    root = user_data["screenshot_path"]
-    if (not choices["media"]):
-        media_group.append(
-            InputMediaPhoto(
-                open(os.path.join(root, "screenshot.png"), "rb"),
-                has_spoiler=choices["censor"],
-            )
+    chat_id = session.chat_id
+    media_items = collect_media_items(session.screenshot_path, choices)
+    new_items = [(file, choices["censor"]) for _, file in media_items]
+
+    # Button clicks of one chat update their albums one after another
+    async with MEDIA_LOCKS.hold(chat_id):
+        plan = plan_album_update(
+            [(file, spoiler) for _, file, spoiler in session.media_messages],
+            new_items,
+            caption != session.caption,
         )
-    if (not choices["screenshot"]):
-        path = os.path.join(root, "media")
-        for file in os.listdir(path):
-            if file.endswith(".png"):
-                media_group.append(
-                    InputMediaPhoto(
-                        open(os.path.join(path, file), "rb"),
-                        has_spoiler=choices["censor"],
-                    )
-                )
-            elif file.endswith(".mp4") or file.endswith(".gif"):
-                media_group.append(
-                    InputMediaVideo(
-                        open(os.path.join(path, file), "rb"),
-                        has_spoiler=choices["censor"],
-                    )
-                )
+        try:
+            if plan is None:
+                await resend_album(context, session, media_items, caption)
+            else:
+                await update_album(context, session, media_items, caption, plan)
+            session.caption = caption
+        except Exception as e:
+            logger.error(f"Failed to update message: {e}")
+
 
-    if "media_message_ids" in user_data:
+async def resend_album(context: ContextTypes.DEFAULT_TYPE, session, media_items, caption):
+    """Deletes the sent album in one call and sends the new one"""
+    chat_id = session.chat_id
+    old_ids = [message_id for message_id, _, _ in session.media_messages]
+    if old_ids:
         try:
-            for message_id in user_data["media_message_ids"]:
-                await context.bot.delete_message(
-                    chat_id=user_data["chat_id"],
-                    message_id=message_id
-                )
+            await call_with_flood_retry(context.bot.delete_messages, chat_id, old_ids)
         except Exception as e:
             logger.error(f"Failed to delete media message: {e}")
             return
+        session.media_messages = []
+    if not media_items:
+        return
 
-    try:
-        media_messages = await context.bot.send_media_group(
-            chat_id=user_data["chat_id"],
+    censor = session.choices["censor"]
+    # file_ids of everything uploaded for this request, so nothing is uploaded twice
+    media_group = await build_media_group(media_items, session.file_ids, censor)
+    with STAGE_SECONDS.time(stage="send_media"):
+        media_messages = await call_with_flood_retry(
+            context.bot.send_media_group,
+            chat_id=chat_id,
             media=media_group,
             caption=caption,
-            reply_to_message_id=control_message_id
+            reply_to_message_id=session.control_message_id,
+        )
+    session.media_messages = [
+        (message.message_id, file, censor) for (_, file), message in zip(media_items, media_messages)
+    ]
+    for (_, file), message in zip(media_items, media_messages):
+        file_id = get_file_id(message)
+        if file_id is not None:
+            session.file_ids[file] = file_id
+
+
+async def update_album(context: ContextTypes.DEFAULT_TYPE, session, media_items, caption, plan):
+    """Edits the sent album in place according to a plan of `plan_album_update`"""
+    positions, edits, deletes, caption_edit = plan
+    chat_id = session.chat_id
+    old_messages = session.media_messages
+    censor = session.choices["censor"]
+
+    with STAGE_SECONDS.time(stage="send_media"):
+        for position, index in edits:
+            [media] = await build_media_group(
+                [media_items[index]],
+                session.file_ids,
+                censor,
+                caption=caption if position == positions[0] else None,
+            )
+            message = await call_with_flood_retry(
+                context.bot.edit_message_media,
+                chat_id=chat_id,
+                message_id=old_messages[position][0],
+                media=media,
+            )
+            file_id = get_file_id(message) if isinstance(message, Message) else None
+            if file_id is not None:
+                session.file_ids[media_items[index][1]] = file_id
+        if caption_edit:
+            await call_with_flood_retry(
+                context.bot.edit_message_caption,
+                chat_id=chat_id,
+                message_id=old_messages[positions[0]][0],
+                caption=caption,
+            )
+        if deletes:
+            await call_with_flood_retry(
+                context.bot.delete_messages, chat_id, [old_messages[position][0] for position in deletes]
+            )
+
+    session.media_messages = [
+        (old_messages[position][0], file, censor)
+        for position, (_, file) in zip(positions, media_items)
+    ]
+
+
+def find_tweet_links(message):
+    """Returns the tweet links of a message, from its text or caption and its hidden links, at most MAX_BATCH_LINKS"""
+    texts = [message.text or message.caption or ""]
+    entities = message.parse_entities() if message.text else message.parse_caption_entities()
+    for entity, text in entities.items():
+        if entity.type == MessageEntity.TEXT_LINK:
+            texts.append(entity.url)
+        elif entity.type == MessageEntity.URL:
+            texts.append(text)
+
+    links = {}
+    for text in texts:
+        for m in TWEET_LINK.finditer(text):
+            # Punctuation around a link in prose, e.g. "(see https://x.com/a/status/1)."
+            links.setdefault(m["tweet_id"], m[0].rstrip(LINK_TRAILING_PUNCTUATION))
+    return list(links.values())[:MAX_BATCH_LINKS]
+
+
+def collect_media_items(root, choices):
+    """Returns (InputMedia type, path) of every file of a capture the user asked for"""
+    media_items = []
+    if (not choices["media"]):
+        for file in sorted(os.listdir(root)):
+            if file.startswith("screenshot.") and file.endswith(PHOTO_EXTENSIONS):
+                media_items.append((InputMediaPhoto, os.path.join(root, file)))
+    if (not choices["screenshot"]):
+        path = os.path.join(root, "media")
+        for file in sorted(os.listdir(path)):
+            if file.endswith(PHOTO_EXTENSIONS):
+                media_items.append((InputMediaPhoto, os.path.join(path, file)))
+            elif file.endswith(VIDEO_EXTENSIONS):
+                media_items.append((InputMediaVideo, os.path.join(path, file)))
+    return media_items
+
+
+async def build_media_group(media_items, file_ids, censor, caption=None):
+    """
+    Turns media items into InputMedia, reusing the file_ids of files Telegram already has
+
+    `caption` goes on the first item.
+    """
+    media_group = []
+    for media_type, file in media_items:
+        if file in file_ids:
+            media = file_ids[file]
+        else:
+            media = await asyncio.get_running_loop().run_in_executor(None, read_media, file)
+        media_group.append(
+            media_type(
+                media,
+                caption=caption if not media_group else None,
+                filename=os.path.basename(file),
+                has_spoiler=censor,
+            )
         )
-        user_data["media_message_ids"] = [m.message_id for m in media_messages]
-    except Exception as e:
-        logger.error(f"Failed to update message: {e}")
+    return media_group
+
+
+def read_media(file):
+    """Reads a capture file into memory, so no file stays open during the upload"""
+    with open(file, "rb") as media:
+        return media.read()
+
+
+def get_file_id(message):
+    """Returns the file_id of the photo or video in a sent message"""
+    if message.photo:
+        return message.photo[-1].file_id
+    media = message.video or message.animation or message.document
+    return media.file_id if media is not None else None
 
 
 def build_keyboard(context: ContextTypes.DEFAULT_TYPE, choices):    
@@ -283,73 +778,89 @@ def build_keyboard(context: ContextTypes.DEFAULT_TYPE, choices):
     ]
 
 
-async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-
-    control_message_id = update.callback_query.message.message_id
-    user_data = context.user_data.get(control_message_id)
-
-    choice = query.data
-    choices = user_data["choices"]
-
-    if choice == "censor":
-        choices["censor"] = not choices["censor"]
-    elif choice == "media":
-        choices["media"] = not choices["media"]
-        if choices["media"]:
-            choices["screenshot"] = False  # Deselect screenshot if media is selected
-    elif choice == "screenshot":
-        choices["screenshot"] = not choices["screenshot"]
-        if choices["screenshot"]:
-            choices["media"] = False  # Deselect media if screenshot is selected
-    context.user_data[control_message_id]["choices"] = choices
-
-    # Update the buttons in the existing message
-    try:
-        await context.bot.edit_message_reply_markup(
-            chat_id=user_data["chat_id"],
-            message_id=control_message_id,
-            reply_markup=InlineKeyboardMarkup(build_keyboard(context, choices))
-        )
-    except Exception as e:
-        print(f"Error updating buttons: {e}")
-
-    # Update the message with the current choices
-    await send_media_message(update, context, control_message_id=control_message_id)
-
-
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
     user = update.effective_user
     await update.message.reply_html(rf"Hi {user.mention_html()}!")
 
 # Add flags for more options
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send the collected metrics to me"""
+    logger.info(f"Asked for stats {update.effective_user.name}, {update.effective_user.id}")
+    if update.effective_user.id != AUTHOR_ID:
+        await update.message.reply_text("Sorry you don't have permissions to see this.")
+        return
+    await update.message.reply_text(format_stats())
+
+
 async def logs(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Send logs to me"""
+    """
+    Send the tail of the logs to me
+
+    /logs [level=ERROR] [minutes=60] [user=<id>] [lines=200]
+    """
     logger.info(f"Asked for logs {update.effective_user.name}, {update.effective_user.id}")
     if update.effective_user.id != AUTHOR_ID:
         await update.message.reply_text("Sorry you don't have permissions to see this.")
         return
-    await update.message.reply_document(document="telegram_bot.log")
-    return
+    try:
+        options = dict(arg.split("=", 1) for arg in context.args)
+        minutes = float(options["minutes"]) if "minutes" in options else None
+        lines = await asyncio.get_running_loop().run_in_executor(
+            None,
+            lambda: read_logs(
+                level=options.get("level"),
+                since=time.time() - minutes * 60 if minutes is not None else None,
+                user=options.get("user"),
+                lines=int(options.get("lines", 200)),
+            ),
+        )
+    except ValueError as err:
+        await update.message.reply_text(f"Usage: /logs [level=ERROR] [minutes=60] [user=<id>] [lines=200]\n{err}")
+        return
+    if not lines:
+        await update.message.reply_text("No log records match.")
+        return
+    await update.message.reply_document(
+        document="\n".join(lines).encode(), filename="telegram_bot.log.jsonl"
+    )
 
 
 def main():
     with TwitterFrameHandler() as default_handler:
-        application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+        builder = (
+            Application.builder()
+            .token(TELEGRAM_BOT_TOKEN)
+            .post_init(default_handler.post_init)
+            .post_shutdown(default_handler.post_shutdown)
+        )
+        if TELEGRAM_API_URL:
+            builder.base_url(f"{TELEGRAM_API_URL.rstrip('/')}/bot")
+            builder.base_file_url(f"{TELEGRAM_API_URL.rstrip('/')}/file/bot")
+        application = builder.build()
         application.add_handler(CommandHandler("start", start))
         application.add_handler(CommandHandler("logs", logs))
+        application.add_handler(CommandHandler("stats", stats))
         application.add_handler(CommandHandler("help", default_handler.help_command))
-        application.add_handler(CallbackQueryHandler(button))
+        application.add_handler(CallbackQueryHandler(default_handler.button))
         application.add_handler(
             MessageHandler(
-                filters.TEXT & ~filters.COMMAND, default_handler.twitter_link_handler
+                (filters.TEXT | filters.CAPTION) & ~filters.COMMAND, default_handler.twitter_link_handler
             )
         )
 
         # Run the bot until the user presses Ctrl-C
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if WEBHOOK_URL:
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=ALLOWED_UPDATES,
+            )
+        else:
+            application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":
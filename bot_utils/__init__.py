@@ -0,0 +1,6 @@
+from .jobs import JobScheduler, SchedulerError, QueueFullError, RateLimitError
+from .expiry import ExpiryService
+from .monitoring import monitor_loop_lag, serve_metrics, format_stats
+from .workers import WorkerPool
+from .albums import ChatLocks, call_with_flood_retry, plan_album_update
+from .sessions import Session, SessionStore
@@ -0,0 +1,84 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from telegram.error import RetryAfter
+
+from tweet_capture import get_logger
+
+logger = get_logger(__name__)
+
+
+async def call_with_flood_retry(call, *args, retries=3, **kwargs):
+    """Calls a Bot API method and waits out Telegram's flood control up to `retries` times"""
+    for attempt in range(retries + 1):
+        try:
+            return await call(*args, **kwargs)
+        except RetryAfter as err:
+            if attempt == retries:
+                raise
+            delay = err.retry_after
+            if hasattr(delay, "total_seconds"):
+                delay = delay.total_seconds()
+            logger.info(f"Hit flood control, retrying in {delay} seconds")
+            await asyncio.sleep(delay)
+
+
+class ChatLocks:
+    """One lock per chat, so the album updates of a chat are sent one after another"""
+
+    def __init__(self):
+        self.locks = {}
+        self.waiting = {}
+
+    @asynccontextmanager
+    async def hold(self, chat_id):
+        lock = self.locks.setdefault(chat_id, asyncio.Lock())
+        self.waiting[chat_id] = self.waiting.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self.waiting[chat_id] -= 1
+            if not self.waiting[chat_id]:
+                del self.waiting[chat_id]
+                del self.locks[chat_id]
+
+
+def plan_album_update(old, new, caption_changed, resend_cost=2):
+    """
+    Plans turning a sent album into a new one in place
+
+    `old` and `new` are lists of (file, spoiler) in album order. Telegram
+    can't add items to a sent album, but it can edit, re-caption and delete
+    them. Returns (positions, edits, deletes, caption_edit):
+
+    - `positions[i]` is the old message that shows `new[i]`
+    - `edits` are the (old position, new index) pairs to edit with editMessageMedia
+    - `deletes` are the old positions to delete
+    - `caption_edit` is True if the first kept message needs editMessageCaption
+
+    Returns None if the album has to be sent again, or if that takes fewer
+    API calls than `resend_cost` (one bulk delete and one sendMediaGroup).
+    """
+    if not old or not new or len(new) > len(old):
+        return None
+
+    # Keep the messages already showing the new files when the order allows it
+    files = [file for file, _ in old]
+    positions = []
+    for file, _ in new:
+        start = positions[-1] + 1 if positions else 0
+        if file not in files[start:]:
+            positions = list(range(len(new)))
+            break
+        positions.append(files.index(file, start))
+
+    edits = [(position, index) for index, position in enumerate(positions) if old[position] != new[index]]
+    deletes = [position for position in range(len(old)) if position not in positions]
+    # The caption of an album lives on its first message, an edit of it sets the caption too
+    first_edited = bool(edits) and edits[0][0] == positions[0]
+    caption_edit = (caption_changed or positions[0] != 0) and not first_edited
+
+    if len(edits) + bool(deletes) + caption_edit > resend_cost:
+        return None
+    return positions, edits, deletes, caption_edit
@@ -0,0 +1,105 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import time
+
+from tweet_capture import get_logger
+
+logger = get_logger(__name__)
+
+
+class ExpiryService:
+    """
+    One timer heap for everything the bot deletes later
+
+    Items are JSON-serializable dicts with a `chat_id`. When items come due,
+    the ones due within the next `batch_window` seconds are taken too, grouped
+    by chat and passed to `handler(chat_id, items)` in one call per chat.
+
+    The heap is saved to `path` whenever it changes, so deadlines survive a
+    restart, items that came due while the bot was down expire on start.
+    """
+
+    def __init__(self, handler, path="expiry.json", batch_window=5):
+        self.handler = handler
+        self.path = path
+        self.batch_window = batch_window
+        self.heap = []
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.dirty = False
+        self.task = None
+
+    def __len__(self):
+        return len(self.heap)
+
+    def start(self):
+        self.__load()
+        self.task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        self.__save()
+
+    def schedule(self, delay, item):
+        """Calls the handler with `item` in `delay` seconds"""
+        heapq.heappush(self.heap, (time.time() + delay, next(self.counter), item))
+        self.dirty = True
+        self.wakeup.set()
+
+    def __due(self):
+        deadline = time.time() + self.batch_window
+        due = {}
+        while self.heap and self.heap[0][0] <= deadline:
+            _, _, item = heapq.heappop(self.heap)
+            due.setdefault(item["chat_id"], []).append(item)
+        return due
+
+    async def __run(self):
+        while True:
+            if self.dirty:
+                self.__save()
+
+            timeout = self.heap[0][0] - time.time() if self.heap else None
+            if timeout is None or timeout > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due = self.__due()
+            self.dirty = True
+            for chat_id, items in due.items():
+                try:
+                    await self.handler(chat_id, items)
+                except Exception:
+                    logger.error(f"Failed to expire {len(items)} items in {chat_id}", exc_info=True)
+
+    def __load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as file:
+                saved = json.load(file)
+            for deadline, item in saved:
+                heapq.heappush(self.heap, (deadline, next(self.counter), item))
+            logger.info(f"Loaded {len(self.heap)} pending expirations")
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load pending expirations: {e}")
+
+    def __save(self):
+        self.dirty = False
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as file:
+                json.dump([[deadline, item] for deadline, _, item in self.heap], file)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Failed to save pending expirations: {e}")
@@ -0,0 +1,207 @@
+import asyncio
+import time
+from collections import Counter, OrderedDict, defaultdict, deque
+
+from tweet_capture import get_logger
+
+logger = get_logger(__name__)
+
+
+class SchedulerError(Exception):
+    """Base job scheduler exception"""
+
+
+class QueueFullError(SchedulerError):
+    """Thrown when the queue is too long to take one more job"""
+
+    def __str__(self) -> str:
+        return "The bot is overloaded right now, please try again in a few minutes"
+
+
+class RateLimitError(SchedulerError):
+    """Thrown when a user sends more jobs than the rate limit allows"""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+
+    def __str__(self) -> str:
+        return f"Too many requests, please wait {self.retry_after} seconds"
+
+
+class Job:
+    def __init__(self, user_id, chat_id, run, on_position, slots=1):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.run = run
+        self.on_position = on_position
+        self.slots = slots
+        self.position = None
+        self.reported = None
+        self.reporter = None
+
+
+class JobScheduler:
+    """
+    A bounded job queue shared fairly between chats
+
+    Jobs wait in one queue per chat, and `workers` tasks take them round robin
+    between chats, so one chat sending many links doesn't delay the others.
+    A user runs at most `user_concurrency` jobs at the same time and submits at
+    most `user_rate` jobs per `rate_window` seconds. When `max_queue` jobs are
+    already waiting, new ones are rejected.
+
+    A job doing several captures is submitted with a `cost` and `slots`: it
+    takes `cost` jobs of the rate limit, and only starts once `slots` workers
+    and `slots` of the user's concurrency are free, which it holds until done.
+
+    `on_position` of a job is called with its place in the queue every time it
+    changes, 0 means the job has started. Jobs that start right away are only
+    reported once they start. The reports run in a background task per job,
+    so neither `submit` nor the start of a job waits for them, and a job whose
+    place changes several times while a report is sent only gets the latest.
+    """
+
+    def __init__(self, workers=1, max_queue=50, user_concurrency=1, user_rate=10, rate_window=60):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.user_concurrency = user_concurrency
+        self.user_rate = user_rate
+        self.rate_window = rate_window
+        self.queues = OrderedDict()
+        self.running = Counter()
+        self.submitted = defaultdict(deque)
+        self.pruned = time.monotonic()
+        self.wakeup = asyncio.Event()
+        self.tasks = []
+        self.reporters = set()
+
+    @property
+    def depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.__worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        tasks = self.tasks + list(self.reporters)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def submit(self, user_id, chat_id, run, on_position=None, cost=1, slots=1):
+        """
+        Queues the coroutine function `run` and returns its place in the queue,
+        0 if a worker is free to start it right away
+
+        `slots` is clamped to what the user and the workers can ever run at once.
+        Raises RateLimitError or QueueFullError if the job isn't accepted.
+        """
+        now = time.monotonic()
+        if now - self.pruned > self.rate_window:
+            self.__prune(now)
+        submitted = self.submitted[user_id]
+        while submitted and now - submitted[0] > self.rate_window:
+            submitted.popleft()
+        if len(submitted) + cost > self.user_rate:
+            # Waits until enough of the oldest submits leave the window
+            expiring = min(len(submitted) + cost - self.user_rate, len(submitted))
+            oldest = submitted[expiring - 1] if expiring else now
+            raise RateLimitError(int(self.rate_window - (now - oldest)) + 1)
+        if self.depth >= self.max_queue:
+            logger.info(f"Queue is full, rejecting a job from {user_id}")
+            raise QueueFullError()
+
+        submitted.extend([now] * cost)
+        job = Job(user_id, chat_id, run, on_position, max(1, min(slots, self.user_concurrency, self.workers)))
+        self.queues.setdefault(chat_id, deque()).append(job)
+        self.wakeup.set()
+        self.__report_positions()
+        return job.position or 0
+
+    def __prune(self, now):
+        """Drops the submit times that left the rate window, and the users left without any"""
+        self.pruned = now
+        for user_id in list(self.submitted):
+            submitted = self.submitted[user_id]
+            while submitted and now - submitted[0] > self.rate_window:
+                submitted.popleft()
+            if not submitted:
+                del self.submitted[user_id]
+
+    def __positions(self):
+        """Queue order of the waiting jobs, round robin between chats"""
+        order = []
+        queues = [list(queue) for queue in self.queues.values()]
+        for depth in range(max((len(queue) for queue in queues), default=0)):
+            order.extend(queue[depth] for queue in queues if depth < len(queue))
+        return order
+
+    def __report_positions(self):
+        # Jobs that idle workers are about to take don't wait in the queue
+        free = self.workers - sum(self.running.values())
+        for position, job in enumerate(self.__positions(), start=1 - free):
+            if position > 0:
+                self.__set_position(job, position)
+
+    def __set_position(self, job, position):
+        if job.position == position:
+            return
+        job.position = position
+        if job.on_position is not None and job.reporter is None:
+            job.reporter = asyncio.create_task(self.__report(job))
+            self.reporters.add(job.reporter)
+            job.reporter.add_done_callback(self.reporters.discard)
+
+    async def __report(self, job):
+        """Sends the latest position of a job until the sent one is current"""
+        try:
+            while job.reported != job.position:
+                position = job.position
+                try:
+                    await job.on_position(position)
+                except Exception as e:
+                    logger.error(f"Failed to report the queue position: {e}")
+                job.reported = position
+        finally:
+            job.reporter = None
+
+    def __next_job(self):
+        for chat_id, queue in self.queues.items():
+            for job in queue:
+                if (
+                    self.running[job.user_id] + job.slots <= self.user_concurrency
+                    and sum(self.running.values()) + job.slots <= self.workers
+                ):
+                    queue.remove(job)
+                    if queue:
+                        # The chat goes to the end of the round
+                        self.queues.move_to_end(chat_id)
+                    else:
+                        del self.queues[chat_id]
+                    return job
+        return None
+
+    async def __worker(self):
+        while True:
+            job = self.__next_job()
+            if job is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            self.running[job.user_id] += job.slots
+            try:
+                self.__set_position(job, 0)
+                self.__report_positions()
+                await job.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.error(f"Job of {job.user_id} failed", exc_info=True)
+            finally:
+                self.running[job.user_id] -= job.slots
+                if self.running[job.user_id] <= 0:
+                    del self.running[job.user_id]
+                # A job of this user may be runnable now
+                self.wakeup.set()
@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+from tweet_capture import Counter, Histogram, get_logger, metrics_registry
+
+logger = get_logger(__name__)
+
+LOOP_LAG_SECONDS = metrics_registry.register(Histogram(
+    "bot_event_loop_lag_seconds",
+    "How late the event loop wakes up a sleeping task",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+))
+
+
+async def monitor_loop_lag(interval=1.0):
+    """Measures how late every `interval` second wakeup of the event loop is"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(0.0, time.perf_counter() - start - interval))
+
+
+async def serve_metrics(host, port):
+    """
+    Starts an HTTP server answering every GET with the metrics
+
+    The answer is in the Prometheus text format, point a scrape job at
+    `http://{host}:{port}/metrics`.
+    """
+
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            if request.startswith(b"GET "):
+                status = "200 OK"
+                body = metrics_registry.render().encode()
+            else:
+                status = "405 Method Not Allowed"
+                body = b""
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Serving metrics on {host}:{port}")
+    return server
+
+
+def format_stats():
+    """A short text summary of the metrics for the /stats command"""
+    lines = []
+    for metric in metrics_registry.metrics:
+        if isinstance(metric, Histogram):
+            for labels, count, mean, p50, p95 in metric.summary():
+                name = labels.get("stage") or metric.name
+                lines.append(f"{name}: {count} times, avg {mean:.3f}s, p50 ≤{p50}s, p95 ≤{p95}s")
+        elif isinstance(metric, Counter):
+            for labels, value in metric.items():
+                label = ", ".join(f"{k}={v}" for k, v in labels.items())
+                lines.append(f"{metric.name}{{{label}}}: {value}")
+        else:
+            lines.append(f"{metric.name}: {metric.get()}")
+    return "\n".join(lines) or "No data yet"
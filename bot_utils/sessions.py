@@ -0,0 +1,180 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+
+from tweet_capture import get_logger
+
+logger = get_logger(__name__)
+
+
+class Session:
+    """State of one request, kept under the id of its control message"""
+
+    __slots__ = (
+        "control_message_id",
+        "chat_id",
+        "user_id",
+        "user_message_id",
+        "choices",
+        "created",
+        "tweet_url",
+        "tweet_info",
+        "screenshot_path",
+        "cache_keys",
+        "file_ids",
+        "media_messages",
+        "caption",
+        "queued",
+        "cache_entries",
+    )
+    # Everything but the live cache entries is saved, those are taken again by key on load
+    PERSISTED = __slots__[:-1]
+
+    def __init__(self, control_message_id, chat_id, user_id, user_message_id, choices, created=None):
+        self.control_message_id = control_message_id
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.user_message_id = user_message_id
+        self.choices = choices
+        self.created = time.time() if created is None else created
+        self.tweet_url = None
+        self.tweet_info = None
+        self.screenshot_path = None
+        self.cache_keys = []
+        self.file_ids = {}
+        # (message_id, file, spoiler) of every message of the sent album
+        self.media_messages = []
+        self.caption = None
+        self.queued = False
+        self.cache_entries = []
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.PERSISTED}
+
+    @classmethod
+    def from_dict(cls, data):
+        session = cls(
+            data["control_message_id"],
+            data["chat_id"],
+            data["user_id"],
+            data["user_message_id"],
+            data["choices"],
+            data["created"],
+        )
+        for name in cls.PERSISTED:
+            if name in data:
+                setattr(session, name, data[name])
+        session.media_messages = [tuple(message) for message in session.media_messages]
+        return session
+
+
+class SessionStore:
+    """
+    Sessions by control message id, bounded in age and number
+
+    Sessions are kept in creation order, so the ones older than `ttl` seconds
+    and the oldest ones over `max_size` are dropped from the front in O(1).
+    `on_evict(session)` is called for every session that leaves the store, so
+    the caller can free what the session holds.
+
+    With a `path` the sessions are saved every `save_interval` seconds and on
+    `stop`, and loaded again on `start`, `on_load(session)` is called for
+    every loaded session.
+    """
+
+    def __init__(self, ttl=3600, max_size=5000, path=None, on_evict=None, on_load=None, save_interval=60):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path = path
+        self.on_evict = on_evict
+        self.on_load = on_load
+        self.save_interval = save_interval
+        self.sessions = OrderedDict()
+        self.task = None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def start(self):
+        if self.path:
+            self.__load()
+            self.task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.path:
+            self.__save()
+
+    def create(self, control_message_id, chat_id, user_id, user_message_id, choices):
+        session = Session(control_message_id, chat_id, user_id, user_message_id, choices)
+        self.sessions[control_message_id] = session
+        self.evict()
+        return session
+
+    def get(self, control_message_id):
+        """Returns the live session or None"""
+        session = self.sessions.get(control_message_id)
+        if session is not None and time.time() - session.created > self.ttl:
+            self.__drop(session)
+            return None
+        return session
+
+    def pop(self, control_message_id):
+        """Removes a session, the caller frees what it holds"""
+        return self.sessions.pop(control_message_id, None)
+
+    def evict(self):
+        deadline = time.time() - self.ttl
+        while self.sessions:
+            oldest = next(iter(self.sessions.values()))
+            if oldest.created >= deadline and len(self.sessions) <= self.max_size:
+                break
+            self.__drop(oldest)
+
+    def __drop(self, session):
+        self.sessions.pop(session.control_message_id, None)
+        if self.on_evict is not None:
+            try:
+                self.on_evict(session)
+            except Exception:
+                logger.error("Failed to free an evicted session", exc_info=True)
+
+    async def __run(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            self.evict()
+            self.__save()
+
+    def __load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as file:
+                saved = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load sessions: {e}")
+            return
+        for data in saved:
+            try:
+                session = Session.from_dict(data)
+            except (KeyError, TypeError):
+                continue
+            self.sessions[session.control_message_id] = session
+            if self.on_load is not None:
+                self.on_load(session)
+        self.evict()
+        logger.info(f"Loaded {len(self.sessions)} sessions")
+
+    def __save(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as file:
+                json.dump([session.to_dict() for session in self.sessions.values()], file)
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Failed to save sessions: {e}")
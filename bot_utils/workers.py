@@ -0,0 +1,208 @@
+import asyncio
+import itertools
+import multiprocessing
+import re
+import threading
+
+from tweet_capture import (
+    FAILURES,
+    STAGE_SECONDS,
+    BasicExceptionTC,
+    TimeoutExceptionTC,
+    TweetCapture,
+    WebdriverExceptionTC,
+    forward_logs,
+    get_log_context,
+    get_logger,
+    set_log_context,
+)
+
+logger = get_logger(__name__)
+
+TWEET_ID = re.compile(r"/status(?:es)?/(\d+)")
+
+
+def worker_main(jobs, results, options, screenshot_format):
+    """
+    Entry point of a worker process
+
+    Owns one TweetCapture with its own Chrome pool and runs the jobs from
+    `jobs` concurrently. Every job answers on `results` with
+    (job id, "ok", tweet info) or (job id, "error", exception class, reason, url).
+    Stage timings are forwarded as (None, "metric", value, labels) and log
+    records as (None, "log", record).
+    """
+    forward_logs(lambda record: results.put((None, "log", record)))
+    tweet = TweetCapture(**options)
+    tweet.set_screenshot_format(*screenshot_format)
+    STAGE_SECONDS.observers.append(lambda value, labels: results.put((None, "metric", value, labels)))
+
+    async def run(job_id, args, kwargs, log_context):
+        set_log_context(*log_context)
+        try:
+            results.put((job_id, "ok", await tweet.capture(*args, **kwargs)))
+        except BasicExceptionTC as err:
+            results.put((job_id, "error", type(err).__name__, str(err), getattr(err, "url", None)))
+        except Exception as err:
+            results.put((job_id, "error", BasicExceptionTC.__name__, repr(err), None))
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        await tweet.start()
+        tasks = set()
+        try:
+            while True:
+                job = await loop.run_in_executor(None, jobs.get)
+                if job is None:
+                    break
+                task = asyncio.create_task(run(*job))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            await tweet.stop()
+
+    try:
+        asyncio.run(main())
+    finally:
+        tweet.quit()
+
+
+def rebuild_exception(name, reason, url):
+    """Turns an error reported by a worker back into a tweet_capture exception"""
+    if name == TimeoutExceptionTC.__name__:
+        return TimeoutExceptionTC(reason, url)
+    if name == WebdriverExceptionTC.__name__:
+        return WebdriverExceptionTC(reason)
+    return BasicExceptionTC()
+
+
+class WorkerPool:
+    """
+    Runs captures in `workers` separate processes
+
+    Every worker process owns its own TweetCapture (created from `options`)
+    and Chrome, so captures scale over the CPU cores. Jobs are routed by the
+    tweet id, so the same tweet always lands on the same worker. Results come
+    back as files in the directory the caller passed, so only the tweet info
+    crosses the process boundary. A crashed worker fails its pending jobs and
+    is started again. Failed jobs are counted in FAILURES of this process.
+
+    It has the same `capture`, `stop` and `quit` as TweetCapture, `start` and
+    `stop` must be called from the running event loop.
+    """
+
+    def __init__(self, workers, options=None, screenshot_format=("png",), check_interval=1.0):
+        self.context = multiprocessing.get_context("spawn")
+        self.options = options or {}
+        self.screenshot_format = screenshot_format
+        self.check_interval = check_interval
+        self.processes = [None] * max(1, workers)
+        self.queues = [None] * len(self.processes)
+        self.results = self.context.Queue()
+        self.pending = {}
+        self.job_ids = itertools.count()
+        self.stopping = False
+        self.closed = False
+        self.reader = None
+        self.monitor = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        for index in range(len(self.processes)):
+            self.__start_worker(index)
+        self.reader = threading.Thread(target=self.__read_results, daemon=True)
+        self.reader.start()
+        self.monitor = asyncio.create_task(self.__monitor())
+
+    async def stop(self):
+        """Stops the monitor, the workers and the result reader while the event loop still runs"""
+        self.stopping = True
+        if self.monitor is not None:
+            self.monitor.cancel()
+            await asyncio.gather(self.monitor, return_exceptions=True)
+            self.monitor = None
+        # Joining blocks, and the reader hands the last results of the workers to this loop meanwhile
+        await self.loop.run_in_executor(None, self.quit)
+
+    async def capture(self, url, path, media_path, **kwargs):
+        tweet_id = TWEET_ID.search(url)
+        index = int(tweet_id[1]) % len(self.processes) if tweet_id else hash(url) % len(self.processes)
+        job_id = next(self.job_ids)
+        future = self.loop.create_future()
+        self.pending[job_id] = (index, future)
+        self.queues[index].put((job_id, (url, path, media_path), kwargs, get_log_context()))
+        try:
+            return await future
+        finally:
+            self.pending.pop(job_id, None)
+
+    def quit(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.stopping = True
+        for queue in self.queues:
+            if queue is not None:
+                queue.put(None)
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+        self.results.put(None)
+        if self.reader is not None:
+            self.reader.join(timeout=10)
+
+    def __start_worker(self, index):
+        self.queues[index] = self.context.Queue()
+        process = self.context.Process(
+            target=worker_main,
+            args=(self.queues[index], self.results, self.options, self.screenshot_format),
+            name=f"tweet_capture-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info(f"Started capture worker {index}, pid {process.pid}")
+
+    def __read_results(self):
+        while True:
+            result = self.results.get()
+            if result is None:
+                return
+            self.loop.call_soon_threadsafe(self.__resolve, result)
+
+    def __resolve(self, result):
+        job_id, status, *payload = result
+        if status == "metric":
+            value, labels = payload
+            # The worker's observers have seen it already, e.g. the stage log
+            STAGE_SECONDS.record(value, **labels)
+            return
+        if status == "log":
+            logger.handle(payload[0])
+            return
+        if status == "error":
+            # Counted here, the counters of the worker processes never reach the metrics endpoint
+            FAILURES.inc(exception=payload[0])
+        _, future = self.pending.get(job_id, (None, None))
+        if future is None or future.done():
+            return
+        if status == "ok":
+            future.set_result(payload[0])
+        else:
+            future.set_exception(rebuild_exception(*payload))
+
+    async def __monitor(self):
+        while not self.stopping:
+            await asyncio.sleep(self.check_interval)
+            for index, process in enumerate(self.processes):
+                if self.stopping or process.is_alive():
+                    continue
+                logger.error(f"Capture worker {index} died with code {process.exitcode}, restarting")
+                for worker, future in list(self.pending.values()):
+                    if worker == index and not future.done():
+                        FAILURES.inc(exception=BasicExceptionTC.__name__)
+                        future.set_exception(BasicExceptionTC())
+                self.__start_worker(index)
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Keep the log of the test run out of the working directory, it's read at import time
+os.environ.setdefault("TWEET_LOG_PATH", os.path.join(tempfile.mkdtemp(), "telegram_bot.log"))
+# bot.py reads its settings at import time
+os.environ.setdefault("TELEGRAM_BOT_AUTHOR", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
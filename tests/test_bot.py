@@ -0,0 +1,27 @@
+import datetime
+
+from telegram import Chat, Message, MessageEntity
+
+from bot import find_tweet_links
+
+
+def message(text, entities=()):
+    return Message(1, datetime.datetime.now(), Chat(1, Chat.PRIVATE), text=text, entities=list(entities))
+
+
+def test_links_of_other_hosts_are_not_tweets():
+    assert find_tweet_links(message("https://fox.com/a/status/55 and netflix.com/b/status/56")) == []
+
+
+def test_punctuation_around_links_is_dropped():
+    text = "(https://x.com/a/status/7). x.com/b/status/8, see www.twitter.com/c/statuses/9?s=1!"
+    assert find_tweet_links(message(text)) == [
+        "https://x.com/a/status/7",
+        "x.com/b/status/8",
+        "www.twitter.com/c/statuses/9?s=1",
+    ]
+
+
+def test_hidden_links_are_found():
+    entity = MessageEntity(MessageEntity.TEXT_LINK, 0, 4, url="https://x.com/a/status/3")
+    assert find_tweet_links(message("look here", [entity])) == ["https://x.com/a/status/3"]
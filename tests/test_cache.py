@@ -0,0 +1,49 @@
+import asyncio
+import os
+
+from tweet_capture import ResultCache
+
+
+def fill(cache, size):
+    path = cache.reserve()
+    with open(os.path.join(path, "screenshot.jpeg"), "wb") as file:
+        file.write(b"x" * size)
+    return path
+
+
+def test_load_keeps_the_newest_entry_of_a_replaced_key(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    old = cache.put("k", fill(cache, 10), ["old"])
+    # Still held, e.g. by a session, when the key is captured again
+    old.refs += 1
+    new = cache.put("k", fill(cache, 20), ["new"])
+    assert sorted(os.listdir(tmp_path)) == sorted([os.path.basename(old.path), os.path.basename(new.path)])
+
+    loaded = ResultCache(str(tmp_path))
+    assert os.listdir(tmp_path) == [os.path.basename(new.path)]
+    assert loaded.get("k").tweet_info == ["new"]
+    assert loaded.total_bytes == new.size
+
+
+def test_acquired_entries_survive_eviction_by_a_capture_finishing_alongside(tmp_path):
+    async def run():
+        cache = ResultCache(str(tmp_path), max_bytes=1500)
+        gate = asyncio.Event()
+
+        async def capture(path):
+            await gate.wait()
+            with open(os.path.join(path, "screenshot.jpeg"), "wb") as file:
+                file.write(b"x" * 1000)
+            return []
+
+        # k2 is put first and evicted by k1 before its caller resumes
+        requests = [asyncio.create_task(cache.acquire(key, capture)) for key in ("k2", "k1", "k1")]
+        await asyncio.sleep(0)
+        gate.set()
+        return cache, await asyncio.gather(*requests)
+
+    cache, (k2, k1, k1_again) = asyncio.run(run())
+    assert k1 is k1_again and k1.refs == 2
+    assert k2.removed and k2.refs == 1 and os.path.isdir(k2.path)
+    cache.release(k2)
+    assert not os.path.exists(k2.path)
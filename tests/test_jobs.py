@@ -0,0 +1,63 @@
+import asyncio
+
+from bot_utils.jobs import JobScheduler, RateLimitError
+
+
+def test_submit_times_of_idle_users_are_dropped():
+    async def run():
+        scheduler = JobScheduler(max_queue=1000, rate_window=0.05)
+        scheduler.start()
+
+        async def job():
+            pass
+
+        for user_id in range(100):
+            await scheduler.submit(user_id, user_id, job)
+        await asyncio.sleep(0.1)
+        await scheduler.submit(1000, 1000, job)
+        await scheduler.stop()
+        return scheduler
+
+    assert list(asyncio.run(run()).submitted) == [1000]
+
+
+def test_batches_take_their_cost_from_the_rate_limit():
+    async def run():
+        scheduler = JobScheduler(user_rate=10)
+
+        async def job():
+            pass
+
+        await scheduler.submit(1, 1, job, cost=8)
+        try:
+            await scheduler.submit(1, 1, job, cost=3)
+        except RateLimitError:
+            return True
+        return False
+
+    assert asyncio.run(run())
+
+
+def test_batches_hold_their_slots_of_the_user_concurrency():
+    async def run():
+        scheduler = JobScheduler(workers=4, user_concurrency=2)
+        scheduler.start()
+        started = []
+        release = asyncio.Event()
+
+        async def job(name):
+            started.append(name)
+            await release.wait()
+
+        await scheduler.submit(1, 1, lambda: job("batch"), cost=5, slots=5)
+        await scheduler.submit(1, 1, lambda: job("single"))
+        await asyncio.sleep(0.01)
+        running = list(started)
+        release.set()
+        await asyncio.sleep(0.01)
+        await scheduler.stop()
+        return running, started
+
+    running, started = asyncio.run(run())
+    assert running == ["batch"]
+    assert started == ["batch", "single"]
@@ -0,0 +1,58 @@
+import base64
+import json
+
+from benchmarks.stand_in_server import tweet_result
+from tweet_capture.network_tc import _find_tweet_media, find_video_variants
+
+API_URL = "https://x.com/i/api/graphql/abc/TweetResultByRestId?variables=%7B%7D"
+
+
+def recorded_answer():
+    """A TweetResultByRestId answer whose tweet has a video and quotes a tweet with another one"""
+    tweet = tweet_result("https://video.twimg.com", "author", 1, photos=1, video=1, verified=False)
+    quoted = tweet_result("https://quoted.twimg.com", "other", 2, photos=0, video=1, verified=False)
+    tweet["quoted_status_result"] = {"result": quoted}
+    return {"data": {"tweetResult": {"result": tweet}}}
+
+
+class FakeDriver:
+    """Answers Network.getResponseBody from recorded bodies by request id"""
+
+    def __init__(self, bodies):
+        self.bodies = bodies
+
+    def execute_cdp_cmd(self, command, params):
+        assert command == "Network.getResponseBody"
+        return self.bodies[params["requestId"]]
+
+
+def response_event(request_id, url):
+    return {"method": "Network.responseReceived", "params": {"requestId": request_id, "response": {"url": url}}}
+
+
+def test_find_tweet_media_only_returns_the_media_of_the_tweet():
+    media = _find_tweet_media(recorded_answer(), "2")
+    assert [item["type"] for item in media] == ["video"]
+    assert media[0]["media_url_https"].startswith("https://quoted.twimg.com/")
+    assert _find_tweet_media(recorded_answer(), "3") == []
+
+
+def test_find_video_variants_picks_the_best_mp4_of_the_api_answer():
+    body = json.dumps(recorded_answer())
+    driver = FakeDriver({
+        "page": {"body": "<html></html>"},
+        "api": {"body": base64.b64encode(body.encode()).decode(), "base64Encoded": True},
+    })
+    events = [
+        {"method": "Network.requestWillBeSent", "params": {"requestId": "api"}},
+        response_event("page", "https://x.com/author/status/1"),
+        response_event("api", API_URL),
+    ]
+    assert find_video_variants(driver, events, 1) == [("https://video.twimg.com/video/1.mp4", "video")]
+
+
+def test_find_video_variants_skips_unreadable_answers():
+    driver = FakeDriver({"broken": {"body": "{not json"}, "api": {"body": json.dumps(recorded_answer())}})
+    events = [response_event("broken", API_URL), response_event("api", API_URL)]
+    assert find_video_variants(driver, events, "1") == [("https://video.twimg.com/video/1.mp4", "video")]
+    assert find_video_variants(driver, [response_event("api", API_URL)], "4") == []
@@ -0,0 +1,61 @@
+import asyncio
+import os
+
+from benchmarks.stand_in_server import start_server
+from tweet_capture.syndication_tc import MediaResolver, syndication_token, to_radix_string
+
+
+def test_to_radix_string_matches_javascript():
+    # Number.prototype.toString(radix) in node
+    assert to_radix_string(0.5, 36) == "0.i"
+    assert to_radix_string(255.5, 16) == "ff.8"
+    assert to_radix_string(0.1, 36) == "0.3lllllllllm"
+    assert to_radix_string(3.0, 2) == "11"
+    assert to_radix_string(35.0, 36) == "z"
+
+
+def test_syndication_token_matches_the_embed_widget():
+    # ((id / 1e15) * Math.PI).toString(36).replace(/(0+|\.)/g, "") in node
+    assert syndication_token(20) == "6dq1a2xwd93"
+    assert syndication_token("1234567890123456789") == "2zqic77uqyk"
+    assert syndication_token(1) == "bhi2ay3f28n"
+
+
+def capture_media(tmp_path, query):
+    server = start_server()
+    base_url = "http://127.0.0.1:%d/tweet-result?%s" % (server.server_address[1], query)
+
+    async def run():
+        resolver = MediaResolver(base_url)
+        try:
+            return await resolver.capture_media("42", str(tmp_path))
+        finally:
+            await resolver.close()
+
+    try:
+        return asyncio.run(run())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_capture_media_downloads_photos_and_videos(tmp_path):
+    tweet_info = capture_media(tmp_path, "photos=2&video=1&verified=1")
+    assert tweet_info == ["TB"]
+    assert sorted(os.listdir(tmp_path)) == ["image_0.png", "image_1.png", "video_0.mp4"]
+    assert os.path.getsize(tmp_path / "video_0.mp4") > 0
+
+
+def test_capture_media_removes_the_files_of_a_failed_download(tmp_path, monkeypatch):
+    download = MediaResolver.download
+
+    async def failing_download(self, url, stem, default_extension=None):
+        if "/video/" in url:
+            # Let the photos land first, so there is something to clean up
+            await asyncio.sleep(0.2)
+            raise OSError("connection reset")
+        return await download(self, url, stem, default_extension)
+
+    monkeypatch.setattr(MediaResolver, "download", failing_download)
+    assert capture_media(tmp_path, "photos=2&video=1") is None
+    assert os.listdir(tmp_path) == []
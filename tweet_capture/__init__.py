@@ -1,3 +1,8 @@
 from .tweet_capture import TweetCapture
+from .pool_tc import DriverPool
+from .cache_tc import ResultCache
+from .syndication_tc import MediaResolver
 from .exceptions_tc import *
-from .logger_config import get_logger
+from .logger_config import forward_logs, get_log_context, get_logger, read_logs, set_log_context
+from .metrics_tc import Counter, Gauge, Histogram, STAGE_SECONDS, CACHE_REQUESTS, FAILURES
+from .metrics_tc import registry as metrics_registry
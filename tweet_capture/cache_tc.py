@@ -0,0 +1,222 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from hashlib import sha256
+from shutil import rmtree
+
+from .logger_config import get_logger
+from .metrics_tc import CACHE_REQUESTS
+
+logger = get_logger(__name__)
+
+META_FILE = "meta.json"
+
+
+class CacheEntry:
+    def __init__(self, key, path, tweet_info, size, created):
+        self.key = key
+        self.path = path
+        self.tweet_info = tweet_info
+        self.size = size
+        self.created = created
+        self.refs = 0
+        self.removed = False
+
+
+class ResultCache:
+    """
+    On-disk cache of capture results
+
+    Every entry is a directory `{root}/{key}-{suffix}` laid out the same way `capture()`
+    writes it (`screenshot.{format}` and `media/`) plus a `meta.json` with the tweet
+    info. Entries expire after `ttl` seconds, and the least recently used ones
+    are evicted when the cache grows over `max_bytes`. The last access time is
+    the mtime of `meta.json`, so the LRU order survives restarts.
+
+    Entries handed out by `acquire` are reference counted: an evicted entry
+    leaves the index at once, but its directory is only deleted when the last
+    holder calls `release`.
+    """
+
+    def __init__(self, root="cache", max_bytes=512 * 1024 * 1024, ttl=24 * 3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.inflight = {}
+        # Callers waiting for each inflight capture, the capture takes their references
+        self.holders = {}
+        os.makedirs(self.root, exist_ok=True)
+        self.__load()
+
+    @staticmethod
+    def make_key(tweet_id, mode, night_mode, only_screenshot, only_media):
+        raw = f"{tweet_id}:{mode}:{night_mode}:{int(bool(only_screenshot))}:{int(bool(only_media))}"
+        return sha256(raw.encode()).hexdigest()
+
+    def get(self, key):
+        """Returns a fresh entry for `key` or None"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if self.__expired(entry):
+            self.__remove(entry)
+            return None
+        self.entries.move_to_end(key)
+        try:
+            os.utime(os.path.join(entry.path, META_FILE))
+        except OSError:
+            self.__remove(entry)
+            return None
+        return entry
+
+    async def acquire(self, key, capture):
+        """
+        Returns a referenced entry for `key`, capturing it if needed
+
+        `capture` is a coroutine function that fills a reserved directory and
+        returns the tweet info. Concurrent calls for the same key share one
+        capture. Every returned entry must be given back with `release`.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            CACHE_REQUESTS.inc(result="hit")
+            entry.refs += 1
+            return entry
+
+        task = self.inflight.get(key)
+        if task is None:
+            CACHE_REQUESTS.inc(result="miss")
+            task = asyncio.create_task(self.__capture(key, capture))
+            self.inflight[key] = task
+        else:
+            CACHE_REQUESTS.inc(result="coalesced")
+            logger.info(f"Waiting for the capture in progress for {key}")
+        # The reference is taken when the entry is put, before another capture can evict it
+        self.holders[key] = self.holders.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done():
+                self.holders[key] -= 1
+            elif not task.cancelled() and task.exception() is None:
+                self.release(task.result())
+            raise
+
+    def pin(self, key):
+        """Returns a referenced entry for `key` if it is cached, without capturing"""
+        entry = self.get(key)
+        if entry is not None:
+            entry.refs += 1
+        return entry
+
+    def release(self, entry):
+        entry.refs -= 1
+        if entry.refs <= 0 and entry.removed:
+            rmtree(entry.path, ignore_errors=True)
+
+    async def __capture(self, key, capture):
+        path = self.reserve()
+        try:
+            try:
+                tweet_info = await capture(path)
+            except BaseException:
+                self.discard(path)
+                raise
+            return self.put(key, path, tweet_info, refs=self.holders.pop(key, 0))
+        finally:
+            self.inflight.pop(key, None)
+            self.holders.pop(key, None)
+
+    def reserve(self):
+        """Creates a temporary directory for a capture that will be `put` later"""
+        path = os.path.join(self.root, f"tmp-{uuid.uuid4().hex}")
+        os.makedirs(os.path.join(path, "media"))
+        return path
+
+    def discard(self, path):
+        rmtree(path, ignore_errors=True)
+
+    def put(self, key, path, tweet_info, refs=0):
+        """Moves a reserved directory into the cache under `key`, already held `refs` times"""
+        created = time.time()
+        with open(os.path.join(path, META_FILE), "w") as meta:
+            json.dump({"key": key, "tweet_info": tweet_info, "created": created}, meta)
+
+        old = self.entries.get(key)
+        if old is not None:
+            self.__remove(old)
+        entry_path = os.path.join(self.root, f"{key}-{uuid.uuid4().hex[:8]}")
+        os.rename(path, entry_path)
+
+        entry = CacheEntry(key, entry_path, tweet_info, self.__dir_size(entry_path), created)
+        entry.refs = refs
+        self.entries[key] = entry
+        self.total_bytes += entry.size
+        self.evict()
+        return entry
+
+    def evict(self):
+        for entry in [e for e in self.entries.values() if self.__expired(e)]:
+            self.__remove(entry)
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            self.__remove(next(iter(self.entries.values())))
+
+    def __load(self):
+        found = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith("tmp-"):
+                rmtree(path, ignore_errors=True)
+                continue
+            try:
+                meta_path = os.path.join(path, META_FILE)
+                with open(meta_path) as meta:
+                    data = json.load(meta)
+                accessed = os.path.getmtime(meta_path)
+                key = data.get("key", name)
+                entry = CacheEntry(key, path, data["tweet_info"], self.__dir_size(path), data["created"])
+            except (OSError, ValueError, KeyError):
+                logger.info(f"Removing broken cache entry {path}")
+                rmtree(path, ignore_errors=True)
+                continue
+            found.append((accessed, entry))
+
+        # A key replaced while its old entry was held leaves two directories, the newest one wins
+        newest = {}
+        for accessed, entry in found:
+            if entry.key not in newest or entry.created > newest[entry.key][1].created:
+                newest[entry.key] = (accessed, entry)
+        for _, entry in found:
+            if newest[entry.key][1] is not entry:
+                logger.info(f"Removing replaced cache entry {entry.path}")
+                rmtree(entry.path, ignore_errors=True)
+
+        for _, entry in sorted(newest.values(), key=lambda item: item[0]):
+            self.entries[entry.key] = entry
+            self.total_bytes += entry.size
+        self.evict()
+        logger.info(f"Loaded {len(self.entries)} cached results, {self.total_bytes} bytes")
+
+    def __expired(self, entry):
+        return time.time() - entry.created > self.ttl
+
+    def __remove(self, entry):
+        if entry.removed:
+            return
+        entry.removed = True
+        self.entries.pop(entry.key, None)
+        self.total_bytes -= entry.size
+        if entry.refs <= 0:
+            rmtree(entry.path, ignore_errors=True)
+
+    def __dir_size(self, path):
+        size = 0
+        for root, _, files in os.walk(path):
+            for file in files:
+                size += os.path.getsize(os.path.join(root, file))
+        return size
@@ -0,0 +1,101 @@
+import contextvars
+import mimetypes
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .logger_config import get_logger
+
+logger = get_logger(__name__)
+
+CONTENT_TYPE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+    "video/mp4": ".mp4",
+}
+
+
+def media_extension(content_type, url, default_extension=None):
+    """
+    Returns the file extension of downloaded media
+
+    From the Content-Type of the answer, then from the url (twitter's
+    `format=` parameter or the path), then `default_extension`.
+    """
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type in CONTENT_TYPE_EXTENSIONS:
+        return CONTENT_TYPE_EXTENSIONS[content_type]
+
+    parsed = urlparse(url)
+    image_format = parse_qs(parsed.query).get("format")
+    if image_format:
+        return f".{image_format[0].lower()}"
+    extension = os.path.splitext(parsed.path)[1].lower()
+    if extension and mimetypes.guess_type(f"file{extension}")[0]:
+        return extension
+    if default_extension:
+        return default_extension
+    logger.info(f"Unknown media type {content_type!r} of {url}")
+    return ".bin"
+
+
+class MediaDownloader:
+    """
+    Downloads tweet media over one connection-pooled session
+
+    At most `max_workers` files are downloaded at the same time. Every request
+    has a (connect, read) `timeout`, failed requests and 429/5xx answers are
+    retried up to `retries` times with a backoff. Files are streamed to disk and
+    get the extension of their real content type.
+    """
+
+    def __init__(self, max_workers=4, timeout=(5, 30), retries=3, chunk_size=64 * 1024):
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_workers,
+            pool_maxsize=max_workers,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=0.3,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["GET"],
+            ),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="tweet_download"
+        )
+
+    def submit(self, url, stem, default_extension=None):
+        """Starts `download` in the background and returns its future"""
+        context = contextvars.copy_context()
+        return self.executor.submit(context.run, self.download, url, stem, default_extension)
+
+    def download(self, url, stem, default_extension=None):
+        """
+        Downloads `url` to `{stem}{extension}` and returns the written path
+
+        The extension is picked by `media_extension`.
+        """
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            extension = media_extension(response.headers.get("Content-Type", ""), url, default_extension)
+            path = f"{stem}{extension}"
+            with open(path, "wb") as file:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    file.write(chunk)
+        return path
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
@@ -1,20 +1,182 @@
-import os
+import atexit
+import contextvars
+import copy
+import gzip
+import json
 import logging
-from logging.handlers import TimedRotatingFileHandler
+import os
+import queue
+import shutil
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from .metrics_tc import STAGE_SECONDS
+
+LOG_PATH = os.getenv("TWEET_LOG_PATH", f"{os.getcwd()}/telegram_bot.log")
+LOG_MAX_BYTES = int(os.getenv("TWEET_LOG_MAX_MB", 10)) * 1024 * 1024
+LOG_BACKUPS = int(os.getenv("TWEET_LOG_BACKUPS", 5))
+
+# Set by the bot for every request, copied into the threads doing its work
+REQUEST_ID = contextvars.ContextVar("request_id", default=None)
+REQUEST_USER = contextvars.ContextVar("request_user", default=None)
+
+# Extra record attributes that end up in the JSON line
+FIELDS = ("request_id", "user", "stage", "seconds")
+
+
+def set_log_context(request_id=None, user=None):
+    """Tags every record logged from the current context with the request id and user"""
+    REQUEST_ID.set(request_id)
+    REQUEST_USER.set(user)
+
+
+def get_log_context():
+    return REQUEST_ID.get(), REQUEST_USER.get()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class GzipRotatingFileHandler(RotatingFileHandler):
+    """Rotates the log by size and compresses the rotated files"""
+
+    def __init__(self, filename, max_bytes, backups):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True)
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self.__compress
+
+    @staticmethod
+    def __compress(source, dest):
+        with open(source, "rb") as plain, gzip.open(dest, "wb") as compressed:
+            shutil.copyfileobj(plain, compressed)
+        os.remove(source)
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    Hands records over to the writer thread
+
+    The record gets the request id and user of the logging context first, and
+    is made picklable, so it may also be sent to another process with `forward`.
+    """
+
+    forward = None
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if getattr(record, "request_id", None) is None:
+            record.request_id, record.user = get_log_context()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.forward is not None:
+            self.forward(record)
+        else:
+            super().enqueue(record)
+
+
+log_queue = queue.SimpleQueue()
+queue_handler = ContextQueueHandler(log_queue)
+file_handler = GzipRotatingFileHandler(LOG_PATH, LOG_MAX_BYTES, LOG_BACKUPS)
+file_handler.setFormatter(JsonFormatter())
+# The only thread that touches the log file
+listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)
+
+
+def forward_logs(send):
+    """
+    Sends the records of this process to `send` instead of the log file
+
+    Used by capture worker processes, the bot process writes their records.
+    """
+    # A second stop at exit fails, the listener's thread is gone by then
+    atexit.unregister(listener.stop)
+    listener.stop()
+    queue_handler.forward = send
+
 
 def get_logger(name):
     # Logger setup
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
-    
-    if not logger.handlers:
-        logger_handler = TimedRotatingFileHandler(
-            filename=f"{os.getcwd()}/telegram_bot.log", when="W4"
-        )
-        logger_handler.setFormatter(
-            logging.Formatter(
-                "%(asctime)s — %(name)s — %(levelname)s — %(message)s", datefmt="%d/%m %H:%M:%S"
-            )
-        )
-        logger.addHandler(logger_handler)
+
+    if queue_handler not in logger.handlers:
+        logger.addHandler(queue_handler)
     return logger
+
+
+def read_logs(level=None, since=None, user=None, lines=200):
+    """
+    Returns the last `lines` JSON lines of the log, newest last
+
+    Only records of at least `level`, logged after the `since` timestamp or
+    belonging to the `user` id are kept. Rotated files are read only
+    while more lines are needed.
+    """
+    minimum = logging.getLevelName(level.upper()) if level else 0
+    if not isinstance(minimum, int):
+        raise ValueError(f"Unknown log level {level}")
+
+    def matches(entry):
+        if logging.getLevelName(entry.get("level", "NOTSET")) < minimum:
+            return False
+        if since is not None and entry.get("time", 0) < since:
+            return False
+        return user is None or str(entry.get("user")) == str(user)
+
+    found = []
+    for index in range(LOG_BACKUPS + 1):
+        path = LOG_PATH if index == 0 else file_handler.rotation_filename(f"{LOG_PATH}.{index}")
+        try:
+            with (gzip.open(path, "rt", encoding="utf-8") if index else open(path, encoding="utf-8")) as file:
+                records = file.read().splitlines()
+        except OSError:
+            break
+        batch = []
+        oldest = None
+        for line in records:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if oldest is None:
+                oldest = entry.get("time")
+            if matches(entry):
+                batch.append(line)
+        found = batch + found
+        if len(found) >= lines or (since is not None and oldest is not None and oldest < since):
+            break
+    return found[-lines:] if lines else []
+
+
+stage_logger = get_logger("tweet_capture.stages")
+STAGE_SECONDS.observers.append(
+    lambda value, labels: stage_logger.info(
+        f"{labels.get('stage')} took {value:.3f}s",
+        extra={"stage": labels.get("stage"), "seconds": round(value, 4)},
+    )
+)
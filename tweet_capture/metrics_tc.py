@@ -0,0 +1,174 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return lines + self._samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def items(self):
+        with self.lock:
+            return [(dict(zip(self.labelnames, key)), value) for key, value in self.values.items()]
+
+    def _samples(self):
+        with self.lock:
+            return [f"{self.name}{self._labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """A gauge that is either `set` or read from `function` on every render"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, function=None):
+        super().__init__(name, documentation)
+        self.function = function
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+    def _samples(self):
+        return [f"{self.name} {self.get()}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.observers = []
+
+    def observe(self, value, **labels):
+        self.record(value, **labels)
+        for observer in self.observers:
+            observer(value, labels)
+
+    def record(self, value, **labels):
+        """Counts a value without notifying the observers, e.g. one already observed in another process"""
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the `with` block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def summary(self):
+        """Returns (labels, count, mean, p50, p95) for every label set"""
+        result = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                count = sum(counts)
+                result.append((
+                    dict(zip(self.labelnames, key)),
+                    count,
+                    total / count if count else 0.0,
+                    self.__quantile(counts, 0.5),
+                    self.__quantile(counts, 0.95),
+                ))
+        return result
+
+    def __quantile(self, counts, q):
+        """Upper bound of the bucket that holds the `q` quantile"""
+        rank = q * sum(counts)
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def _samples(self):
+        lines = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{self._labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_sum{self._labels(key)} {total}")
+                lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text format"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "tweet_capture_stage_seconds",
+    "Duration of every stage of processing a tweet",
+    labelnames=["stage"],
+))
+CACHE_REQUESTS = registry.register(Counter(
+    "tweet_capture_cache_requests_total",
+    "Result cache lookups by outcome (hit, coalesced, miss)",
+    labelnames=["result"],
+))
+FAILURES = registry.register(Counter(
+    "tweet_capture_failures_total",
+    "Failed captures by exception class",
+    labelnames=["exception"],
+))
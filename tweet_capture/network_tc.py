@@ -0,0 +1,156 @@
+import base64
+import json
+import re
+
+from selenium.common.exceptions import WebDriverException
+
+from .logger_config import get_logger
+
+logger = get_logger(__name__)
+
+TWEET_API_URL = re.compile(r"/graphql/[^/]+/(TweetResultByRestId|TweetDetail)")
+TWITTER_DOMAINS = (".twitter.com", ".x.com")
+
+# Url patterns (DevTools wildcard syntax) that are never requested by the capture browser
+BLOCK_PROFILES = {
+    "none": [],
+    # Analytics, ads, client event logging and the sidebar widgets hidden by capture()
+    "default": [
+        "*google-analytics.com*",
+        "*googletagmanager.com*",
+        "*doubleclick.net*",
+        "*ads-twitter.com*",
+        "*ads-api.twitter.com*",
+        "*analytics.twitter.com*",
+        "*/jot/*",
+        "*/i/api/1.1/hashflags.json*",
+        "*/i/api/2/guide.json*",
+        "*/i/api/graphql/*/ExplorePage*",
+        "*/i/api/graphql/*/SidebarUserRecommendations*",
+        "*/i/api/graphql/*/useFetchProfileSections*",
+    ],
+}
+# Also drops web fonts (the screenshot falls back to system fonts) and video streams,
+# the video files themselves are downloaded separately
+BLOCK_PROFILES["strict"] = BLOCK_PROFILES["default"] + [
+    "*.woff",
+    "*.woff2",
+    "*.m3u8*",
+    "*.m4s*",
+    "*video.twimg.com/*.mp4*",
+]
+
+
+def set_cookies(driver, cookies, domains=TWITTER_DOMAINS):
+    """
+    Sets cookies for `domains` through DevTools
+
+    Unlike `driver.add_cookie` this works before the first navigation,
+    so the page gets the cookies on its very first load.
+    """
+    for domain in domains:
+        for name, value in cookies.items():
+            driver.execute_cdp_cmd(
+                "Network.setCookie",
+                {"name": name, "value": str(value), "domain": domain, "path": "/", "secure": True},
+            )
+
+
+def block_urls(driver, patterns):
+    """Makes the browser fail every request matching one of `patterns`"""
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(patterns)})
+
+
+def network_stats(events):
+    """Returns the request count, the received bytes and the blocked request count"""
+    requests = 0
+    received = 0
+    blocked = 0
+    for event in events:
+        method = event["method"]
+        if method == "Network.requestWillBeSent":
+            requests += 1
+        elif method == "Network.loadingFinished":
+            received += event["params"].get("encodedDataLength", 0)
+        elif method == "Network.loadingFailed" and event["params"].get("blockedReason"):
+            blocked += 1
+    return {"requests": requests, "bytes": int(received), "blocked": blocked}
+
+
+def clear_network_log(driver):
+    """Drops the performance log collected so far"""
+    driver.get_log("performance")
+
+
+def read_network_events(driver):
+    """
+    Drains Chrome's performance log and returns its Network.* events
+
+    The driver must be started with the `performance` logging preference,
+    every event is the DevTools message, a dict with `method` and `params`.
+    """
+    events = []
+    for entry in driver.get_log("performance"):
+        try:
+            message = json.loads(entry["message"])["message"]
+        except (KeyError, ValueError):
+            continue
+        if message.get("method", "").startswith("Network."):
+            events.append(message)
+    return events
+
+
+def get_response_json(driver, request_id):
+    body = driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+    data = body["body"]
+    if body.get("base64Encoded"):
+        data = base64.b64decode(data)
+    return json.loads(data)
+
+
+def find_video_variants(driver, events, tweet_id):
+    """
+    Finds the videos and GIFs of a tweet in the API answers the page loaded
+
+    Returns a list of (url, media type) with the highest bitrate MP4 of every
+    video or GIF attached to the tweet itself (not to quoted tweets or replies).
+    """
+    videos = []
+    for event in events:
+        if event["method"] != "Network.responseReceived":
+            continue
+        response = event["params"]["response"]
+        if not TWEET_API_URL.search(response["url"]):
+            continue
+        try:
+            data = get_response_json(driver, event["params"]["requestId"])
+        except (WebDriverException, ValueError) as e:
+            logger.info(f"Can't read the tweet API answer: {e}")
+            continue
+        for media in _find_tweet_media(data, str(tweet_id)):
+            variants = [
+                v for v in media.get("video_info", {}).get("variants", [])
+                if v.get("content_type") == "video/mp4"
+            ]
+            if variants:
+                best = max(variants, key=lambda v: v.get("bitrate", 0))
+                videos.append((best["url"], media.get("type")))
+        if videos:
+            break
+    return videos
+
+
+def _find_tweet_media(data, tweet_id):
+    """Walks an API answer and returns the media list of the tweet `tweet_id`"""
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            legacy = node.get("legacy")
+            if node.get("rest_id") == tweet_id and isinstance(legacy, dict):
+                return legacy.get("extended_entities", {}).get("media", [])
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return []
@@ -0,0 +1,115 @@
+from .logger_config import get_logger
+
+logger = get_logger(__name__)
+
+# .r-rthrr5 { width: 100% !important; } idk twitter removed it
+SCALE_CSS = ".r-1ye8kvj { max-width: 40rem !important; } body { scale: 1 !important; transform-origin: 0 0 !important; }"
+
+HIDE_ITEMS_XPATH = [
+    "/html/body/div/div/div/div[1]",
+    "/html/body/div/div/div/div[2]/header",
+    "/html/body/div/div/div/div[2]/main/div/div/div/div/div/div[1]",
+    "//div[@data-testid='BottomBar' and contains(@style,'transition-property')]",
+    "(//ancestor::div[@dir = 'ltr'])"
+    "//article[@data-testid='tweet']//button[contains(@aria-label,'Grok')]",
+    "//article[@data-testid='tweet']//a[@data-testid='logged_out_read_replies_pivot']",
+]
+
+FOOTER_XPATHS = [
+    "((//ancestor::time)/..)[contains(@aria-describedby, 'id__')]",  # date
+    "//div[contains(@role, 'group')][not(contains(@id, 'id__'))]",  # date 2????
+    "//div[contains(@role, 'group')][contains(@id, 'id__')]",  # likes/replies/reply
+]
+
+# Indexes of FOOTER_XPATHS hidden in every display mode
+FOOTER_HIDES = {
+    0: [0, 1, 2],
+    1: [0, 2],
+    2: [2],
+    3: [],
+}
+
+PHOTOS_XPATH = "//article//div[@data-testid='tweetPhoto' and not(ancestor::div[@role='link'])]/img"
+VIDEOS_XPATH = "//article//div[@data-testid='videoComponent' and not(ancestor::div[@role='link'])]"
+
+PREPARE_SCRIPT = """
+const [tweet, options] = arguments;
+const report = {hidden: [], missing: [], footer: {}, padded: false};
+
+const nodes = (xpath, context) => {
+    try {
+        const result = document.evaluate(
+            xpath, context, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+        );
+        return Array.from({length: result.snapshotLength}, (_, i) => result.snapshotItem(i));
+    } catch (e) {
+        return [];
+    }
+};
+
+const style = document.createElement('style');
+style.innerHTML = options.css;
+document.head.appendChild(style);
+
+for (const xpath of options.hide) {
+    const element = nodes(xpath, document)[0];
+    if (element) {
+        element.style.display = 'none';
+        report.hidden.push(xpath);
+    } else {
+        report.missing.push(xpath);
+    }
+}
+if (document.activeElement) {
+    document.activeElement.blur();
+}
+
+for (const xpath of options.footer) {
+    const elements = nodes(xpath, tweet);
+    elements.forEach(element => element.style.display = 'none');
+    report.footer[xpath] = elements.length;
+}
+
+if (options.padBottom) {
+    const inner = tweet.querySelector('article');
+    if (inner && inner.childNodes[0]) {
+        inner.childNodes[0].style.paddingBottom = options.padBottom;
+        report.padded = true;
+    }
+}
+window.scrollTo(0, 0);
+
+report.verified = !!tweet.querySelector("svg[data-testid='icon-verified']");
+report.photos = nodes(options.photos, tweet).map(image => image.src);
+report.videos = nodes(options.videos, tweet).length;
+return report;
+"""
+
+
+def prepare_page(driver, tweet, mode):
+    """
+    Cleans the tweet page up for the screenshot in one `execute_script` call
+
+    Hides the global page items and the footer items of the display `mode`,
+    adds the scale css and the bottom padding, and returns a report with what
+    was matched, whether the author is verified, the photo urls and the video
+    count of the tweet.
+    """
+    report = driver.execute_script(
+        PREPARE_SCRIPT,
+        tweet,
+        {
+            "css": SCALE_CSS,
+            "hide": HIDE_ITEMS_XPATH,
+            "footer": [FOOTER_XPATHS[i] for i in FOOTER_HIDES.get(mode, [])],
+            "padBottom": "35px" if mode in (0, 1) else None,
+            "photos": PHOTOS_XPATH,
+            "videos": VIDEOS_XPATH,
+        },
+    )
+    missing = report["missing"] + [
+        xpath for xpath, count in report["footer"].items() if count == 0
+    ]
+    if missing:
+        logger.info(f"Page items not found, the layout may have changed: {missing}")
+    return report
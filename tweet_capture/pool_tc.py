@@ -0,0 +1,248 @@
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+from selenium.common.exceptions import InvalidSessionIdException, WebDriverException
+
+from .exceptions_tc import WebdriverExceptionTC
+from .logger_config import get_logger
+from .metrics_tc import STAGE_SECONDS
+from .webdriver_tc import get_driver
+
+logger = get_logger(__name__)
+
+
+def process_tree_rss(pid):
+    """Resident memory of process `pid` and all of its descendants in bytes, 0 where /proc is missing"""
+    parents, rss = {}, {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return 0
+    for entry in filter(str.isdigit, entries):
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # The command name may contain spaces, the fields after it don't
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        parents[int(entry)] = int(fields[1])
+        rss[int(entry)] = int(fields[21])
+
+    tree, stack = set(), [pid]
+    while stack:
+        current = stack.pop()
+        tree.add(current)
+        stack.extend(child for child, parent in parents.items() if parent == current and child not in tree)
+    return sum(rss.get(p, 0) for p in tree) * os.sysconf("SC_PAGE_SIZE")
+
+
+class DriverPool:
+    """
+    A pool of at most `size` Chrome drivers in use at the same time
+
+    `start` launches the drivers up front together with `spares` warm standby
+    ones, at most `size` of them are checked out at the same time and every
+    other caller waits for a free one. A driver is checked for health on every
+    checkout. It is recycled after `max_uses` captures, and a watchdog
+    recycles idle drivers whose browser takes more than `max_rss` bytes. Dead
+    and recycled drivers are replaced in the background, so a capture only
+    waits for a browser start when no warm driver is left.
+
+    Every call to a driver blocks, so the pool also owns a thread executor with
+    one thread per driver, use `run` to do the driver work there.
+
+    Shut the pool down with `stop` while the event loop runs, `close` only
+    quits what is left and is safe to call once the loop is closed.
+    """
+
+    def __init__(self, size=1, driver_path=None, spares=1, max_uses=100, max_rss=None, check_interval=30):
+        self.size = max(1, size)
+        self.driver_path = driver_path
+        self.spares = max(0, spares)
+        self.max_uses = max_uses
+        self.max_rss = max_rss
+        self.check_interval = check_interval
+        self.drivers = set()
+        self.idle = []
+        self.uses = {}
+        self.launching = 0
+        self.tasks = set()
+        self.watchdog = None
+        self.closed = False
+        self.semaphore = asyncio.Semaphore(self.size)
+        # A thread per checked out driver, per background launch and one for the watchdog
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.size + self.spares + 1, thread_name_prefix="tweet_capture"
+        )
+
+    async def start(self):
+        """Launches the drivers and the memory watchdog, must be called from the running event loop"""
+        if self.watchdog is None:
+            self.watchdog = asyncio.create_task(self.__watch())
+            await self.__refill()
+
+    async def run(self, func, *args, **kwargs):
+        """Runs a blocking function in the pool's executor, in a copy of the caller's context"""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, partial(context.run, func, *args, **kwargs))
+
+    @asynccontextmanager
+    async def driver(self):
+        """Checks out a driver for the duration of the `async with` block"""
+        driver = await self.acquire()
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    async def acquire(self):
+        if self.watchdog is None:
+            self.__spawn(self.start())
+        await self.semaphore.acquire()
+        try:
+            while self.idle:
+                driver = self.idle.pop()
+                if await self.run(self.__driver_alive, driver):
+                    self.uses[driver] += 1
+                    return driver
+                logger.info("Dropping a dead driver from the pool")
+                self.__retire(driver)
+            # No warm driver left, e.g. the background launches haven't finished yet
+            driver = await self.__launch()
+            self.uses[driver] += 1
+            return driver
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    def release(self, driver):
+        if driver in self.drivers:
+            if self.max_uses and self.uses[driver] >= self.max_uses:
+                logger.info(f"Recycling a driver after {self.uses[driver]} captures")
+                self.__retire(driver)
+            elif len(self.drivers) > self.size + self.spares:
+                self.__retire(driver)
+            else:
+                self.idle.append(driver)
+        self.semaphore.release()
+
+    async def stop(self):
+        """Stops the watchdog, waits for the background work and quits the drivers"""
+        self.closed = True
+        if self.watchdog is not None:
+            self.watchdog.cancel()
+            await asyncio.gather(self.watchdog, return_exceptions=True)
+        # Launches aren't cancelled, a browser that is still starting is quit once it's up
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        await asyncio.gather(
+            *(self.run(self.__quit, driver) for driver in list(self.drivers)), return_exceptions=True
+        )
+        self.idle.clear()
+
+    def close(self):
+        self.closed = True
+        for task in [self.watchdog, *self.tasks]:
+            # Tasks of a closed loop can't be cancelled anymore, and never run again anyway
+            if task is not None and not task.done() and not task.get_loop().is_closed():
+                task.cancel()
+        for driver in list(self.drivers):
+            self.__quit(driver)
+        self.idle.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __launch(self):
+        # Started as a task of the pool, so a cancelled caller doesn't lose a browser that is starting
+        task = self.__spawn(self.__start_driver())
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            task.add_done_callback(self.__keep_idle)
+            raise
+
+    def __keep_idle(self, task):
+        if not task.cancelled() and task.exception() is None:
+            self.idle.append(task.result())
+
+    async def __start_driver(self):
+        with STAGE_SECONDS.time(stage="get_driver"):
+            driver = await get_driver(self.driver_path, executor=self.executor)
+        if self.closed:
+            self.__quit(driver)
+            raise WebdriverExceptionTC("Driver pool is closed")
+        self.drivers.add(driver)
+        self.uses[driver] = 0
+        return driver
+
+    async def __launch_idle(self):
+        try:
+            self.idle.append(await self.__launch())
+        except WebdriverExceptionTC as err:
+            logger.error(f"Failed to launch a standby driver: {err}")
+        finally:
+            self.launching -= 1
+
+    async def __refill(self):
+        """Launches drivers until the pool has `size` plus `spares` of them"""
+        launches = []
+        while not self.closed and len(self.drivers) + self.launching < self.size + self.spares:
+            # Counted before the launch starts, so refills running side by side don't overshoot
+            self.launching += 1
+            launches.append(self.__launch_idle())
+        await asyncio.gather(*launches)
+
+    def __retire(self, driver):
+        """Quits a driver and launches its replacement, both in the background"""
+        self.drivers.discard(driver)
+        self.uses.pop(driver, None)
+        if driver in self.idle:
+            self.idle.remove(driver)
+        if not self.closed:
+            self.__spawn(self.run(self.__quit, driver))
+            self.__spawn(self.__refill())
+
+    def __spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def __watch(self):
+        while not self.closed:
+            await asyncio.sleep(self.check_interval)
+            for driver in list(self.idle):
+                alive = await self.run(self.__driver_alive, driver)
+                # Skip the drivers checked out while this one was checked
+                if driver not in self.idle:
+                    continue
+                if not alive:
+                    logger.info("Dropping a dead driver from the pool")
+                    self.__retire(driver)
+                    continue
+                if self.max_rss:
+                    rss = await self.run(process_tree_rss, driver.service.process.pid)
+                    if rss > self.max_rss and driver in self.idle:
+                        logger.info(f"Recycling a driver using {rss // 2**20} MiB")
+                        self.__retire(driver)
+            await self.__refill()
+
+    def __driver_alive(self, driver):
+        if driver.service.process is None or driver.service.process.poll() is not None:
+            return False
+        try:
+            driver.title
+            return True
+        except (InvalidSessionIdException, WebDriverException):
+            return False
+
+    def __quit(self, driver):
+        self.drivers.discard(driver)
+        try:
+            driver.quit()
+        except Exception:
+            pass
@@ -0,0 +1,89 @@
+from selenium.common.exceptions import TimeoutException
+
+from .logger_config import get_logger
+
+logger = get_logger(__name__)
+
+TWEET_SELECTOR = "article[data-testid='tweet']"
+
+# Resolves with {article, ready} once the tweet article is in the page and
+# every image in it is decoded, and no new image showed up for `quiet` ms.
+# A MutationObserver reports the DOM changes, so nothing is polled. Changes
+# that bring no new image into the article, e.g. replies loading below it,
+# don't restart the quiet period.
+READY_SCRIPT = """
+const [selector, timeout, quiet, done] = arguments;
+const seen = new WeakSet();
+let article = null;
+let pending = 0;
+let finished = false;
+let quietTimer = null;
+
+const finish = (ready) => {
+    if (finished) return;
+    finished = true;
+    observer.disconnect();
+    clearTimeout(timeoutTimer);
+    clearTimeout(quietTimer);
+    done({article: article || document.querySelector(selector), ready: ready});
+};
+const settle = () => {
+    clearTimeout(quietTimer);
+    if (pending === 0) quietTimer = setTimeout(() => finish(true), quiet);
+};
+// Returns whether the article has images that weren't seen yet
+const track = () => {
+    let found = false;
+    for (const img of article.querySelectorAll("img")) {
+        if (seen.has(img)) continue;
+        seen.add(img);
+        found = true;
+        pending++;
+        // Broken images must not hold the capture back, they are just skipped
+        img.decode().catch(() => null).then(() => { pending--; settle(); });
+    }
+    return found;
+};
+const observer = new MutationObserver((mutations) => {
+    if (article === null) {
+        article = document.querySelector(selector);
+        if (article === null) return;
+        track();
+        settle();
+        return;
+    }
+    // An image whose src changed is decoded again
+    for (const mutation of mutations) {
+        if (mutation.type === "attributes") seen.delete(mutation.target);
+    }
+    if (track()) settle();
+});
+const timeoutTimer = setTimeout(() => finish(false), timeout);
+
+article = document.querySelector(selector);
+observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true, attributeFilter: ["src"]});
+if (article !== null) {
+    track();
+    settle();
+}
+"""
+
+
+def wait_for_tweet(driver, timeout, quiet=0.1):
+    """
+    Waits until the tweet is rendered and returns its article element
+
+    The page reports readiness itself: the injected READY_SCRIPT resolves as
+    soon as the article is there and its photos, avatar and video posters are
+    decoded, so the screenshot never shows half-loaded images. If the article
+    is there but its images aren't decoded within `timeout` seconds, the
+    article is returned anyway. Raises TimeoutException if there is no article.
+    """
+    # Selenium's own timeout only fires if the script breaks, the script's timer goes first
+    driver.set_script_timeout(timeout + 5)
+    result = driver.execute_async_script(READY_SCRIPT, TWEET_SELECTOR, int(timeout * 1000), int(quiet * 1000))
+    if result["article"] is None:
+        raise TimeoutException(f"No tweet in the page after {timeout} seconds")
+    if not result["ready"]:
+        logger.info(f"Tweet images weren't decoded in {timeout} seconds, capturing anyway")
+    return result["article"]
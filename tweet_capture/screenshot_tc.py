@@ -0,0 +1,52 @@
+import base64
+
+from .logger_config import get_logger
+
+logger = get_logger(__name__)
+
+EXTENSIONS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+
+ELEMENT_RECT_SCRIPT = """
+const rect = arguments[0].getBoundingClientRect();
+return {
+    x: rect.left + window.scrollX,
+    y: rect.top + window.scrollY,
+    width: rect.width,
+    height: rect.height,
+};
+"""
+
+
+def screenshot_element(driver, element, stem, image_format="png", quality=90, max_bytes=None, min_quality=40):
+    """
+    Saves a screenshot of `element` to `{stem}.{extension}` and returns the path
+
+    The page is captured with DevTools `Page.captureScreenshot` clipped to the
+    element, so nothing outside of it is encoded. `image_format` is one of
+    png, jpeg or webp. For the lossy formats the quality is lowered step by
+    step down to `min_quality` until the image fits into `max_bytes`.
+    """
+    if image_format not in EXTENSIONS:
+        raise ValueError(f"Unknown screenshot format {image_format}")
+    rect = driver.execute_script(ELEMENT_RECT_SCRIPT, element)
+    params = {
+        "format": image_format,
+        "clip": {**rect, "scale": 1},
+        "captureBeyondViewport": True,
+        "fromSurface": True,
+    }
+
+    while True:
+        if image_format != "png":
+            params["quality"] = quality
+        data = base64.b64decode(driver.execute_cdp_cmd("Page.captureScreenshot", params)["data"])
+        if not max_bytes or len(data) <= max_bytes or image_format == "png" or quality <= min_quality:
+            break
+        quality = max(min_quality, quality - 15)
+
+    if max_bytes and len(data) > max_bytes:
+        logger.info(f"Screenshot is {len(data)} bytes, over the {max_bytes} bytes budget")
+    path = f"{stem}.{EXTENSIONS[image_format]}"
+    with open(path, "wb") as file:
+        file.write(data)
+    return path
@@ -0,0 +1,169 @@
+import asyncio
+import math
+import os
+import re
+
+import httpx
+
+from .download_tc import media_extension
+from .logger_config import get_logger
+
+logger = get_logger(__name__)
+
+# The JSON endpoint behind twitter's embedded tweets, it needs no login
+SYNDICATION_URL = "https://cdn.syndication.twimg.com/tweet-result"
+
+BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def syndication_token(tweet_id):
+    """The `token` the embed widget sends: ((id / 1e15) * Math.PI).toString(36) without zeros and the dot"""
+    # The widget's id is a JS number, so it's rounded to a double first
+    return to_radix_string(float(int(tweet_id)) / 1e15 * math.pi, 36).replace("0", "").replace(".", "")
+
+
+def to_radix_string(value, radix):
+    """
+    `Number.prototype.toString(radix)` of a positive finite float, as V8 does it
+
+    The fraction gets the fewest digits that still read back as `value`,
+    not a fixed number of them.
+    """
+    integer = math.floor(value)
+    fraction = value - integer
+    # Half the distance to the next float, digits below it don't change the value
+    delta = max(0.5 * (math.nextafter(value, math.inf) - value), math.nextafter(0.0, 1.0))
+    digits = []
+    if fraction >= delta:
+        while True:
+            fraction *= radix
+            delta *= radix
+            digit = int(fraction)
+            digits.append(digit)
+            fraction -= digit
+            if (fraction > 0.5 or (fraction == 0.5 and digit & 1)) and fraction + delta > 1:
+                # Round up, carrying over the digits that are already the highest one
+                while digits and digits[-1] + 1 == radix:
+                    digits.pop()
+                if digits:
+                    digits[-1] += 1
+                else:
+                    integer += 1
+                break
+            if fraction < delta:
+                break
+
+    whole = ""
+    while True:
+        integer, digit = divmod(integer, radix)
+        whole = BASE36[digit] + whole
+        if not integer:
+            break
+    if not digits:
+        return whole
+    return whole + "." + "".join(BASE36[digit] for digit in digits)
+
+
+def find_syndication_media(data):
+    """
+    Returns the (url, default extension) of every photo, video and GIF of a tweet-result answer
+
+    Photos are asked for in their large size, videos and GIFs as their highest bitrate MP4.
+    """
+    media = []
+    for item in data.get("mediaDetails", []):
+        if item.get("type") == "photo":
+            url = item["media_url_https"]
+            if re.search(r"[?&]name=", url):
+                url = re.sub(r"(?<=[?&]name=)\w+", "large", url)
+            else:
+                url += ("&" if "?" in url else "?") + "name=large"
+            media.append((url, None))
+            continue
+        variants = [
+            v for v in item.get("video_info", {}).get("variants", [])
+            if v.get("content_type") == "video/mp4"
+        ]
+        if variants:
+            media.append((max(variants, key=lambda v: v.get("bitrate", 0))["url"], ".mp4"))
+    return media
+
+
+class MediaResolver:
+    """
+    Fetches the media of a tweet without a browser
+
+    The tweet is looked up at the embed widget's JSON endpoint `base_url`
+    (a query string in it is kept) and its photos, videos and GIFs are
+    downloaded with one pooled async HTTP client. Everything runs on the event
+    loop, only the file writes go to a thread.
+    """
+
+    def __init__(self, base_url=SYNDICATION_URL, timeout=10, max_connections=16):
+        self.base_url = base_url
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            follow_redirects=True,
+        )
+
+    async def resolve(self, tweet_id):
+        """Returns (tweet info, media) of the tweet, see `find_syndication_media`, or None"""
+        try:
+            response = await self.client.get(
+                self.base_url, params={"id": tweet_id, "token": syndication_token(tweet_id), "lang": "en"}
+            )
+            response.raise_for_status()
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            logger.info(f"Can't resolve tweet {tweet_id} without a browser: {e}")
+            return None
+        # Deleted, protected or age restricted tweets come back as tombstones
+        if data.get("id_str") != str(tweet_id):
+            logger.info(f"The embed endpoint doesn't show tweet {tweet_id}")
+            return None
+        tweet_info = ["TB"] if data.get("user", {}).get("is_blue_verified") else []
+        return tweet_info, find_syndication_media(data)
+
+    async def download(self, url, stem, default_extension=None):
+        """Downloads `url` to `{stem}{extension}` and returns the written path"""
+        async with self.client.stream("GET", url) as response:
+            response.raise_for_status()
+            path = f"{stem}{media_extension(response.headers.get('Content-Type', ''), url, default_extension)}"
+            data = await response.aread()
+        await asyncio.get_running_loop().run_in_executor(None, write_file, path, data)
+        return path
+
+    async def capture_media(self, tweet_id, media_path):
+        """
+        Downloads the media of a tweet into `media_path` like `capture()` does
+
+        Returns the tweet info, or None (with nothing left in `media_path`)
+        if the tweet or one of its files can't be fetched this way.
+        """
+        resolved = await self.resolve(tweet_id)
+        if resolved is None:
+            return None
+        tweet_info, media = resolved
+        photos = [url for url, extension in media if extension is None]
+        videos = [url for url, extension in media if extension is not None]
+        downloads = [self.download(url, f"{media_path}/image_{i}") for i, url in enumerate(photos)]
+        downloads += [self.download(url, f"{media_path}/video_{i}", ".mp4") for i, url in enumerate(videos)]
+        results = await asyncio.gather(*downloads, return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            logger.info(f"Can't download the media of tweet {tweet_id} without a browser: {errors[0]!r}")
+            for result in results:
+                if isinstance(result, str):
+                    os.remove(result)
+            return None
+        logger.info(f"Fetched {len(photos)} photos and {len(videos)} videos of tweet {tweet_id} without a browser")
+        return tweet_info
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def write_file(path, data):
+    with open(path, "wb") as file:
+        file.write(data)
@@ -1,110 +1,179 @@
-import asyncio
 import re
-import requests
+import time
 
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, InvalidSessionIdException, WebDriverException
+from selenium.common.exceptions import TimeoutException
 
 from .exceptions_tc import BasicExceptionTC, TimeoutExceptionTC
 
+from .download_tc import MediaDownloader
+from .logger_config import get_logger
+from .metrics_tc import FAILURES, STAGE_SECONDS
+from .network_tc import (
+    BLOCK_PROFILES,
+    block_urls,
+    clear_network_log,
+    network_stats,
+    read_network_events,
+    set_cookies,
+)
+from .page_tc import prepare_page
+from .pool_tc import DriverPool
+from .ready_tc import wait_for_tweet
+from .screenshot_tc import EXTENSIONS as SCREENSHOT_EXTENSIONS, screenshot_element
+from .syndication_tc import SYNDICATION_URL, MediaResolver
 from .video_tc import get_videos
-from .webdriver_tc import get_driver
 
+logger = get_logger(__name__)
 
-class TweetCapture:
-    driver = None
-    driver_path = None
-    driver_lock = asyncio.Lock()
 
-    def __init__(self, mode=3, night_mode=0, wait_time = 15):
+class TweetCapture:
+    def __init__(
+        self,
+        mode=3,
+        night_mode=0,
+        wait_time = 15,
+        pool_size=1,
+        block_profile="default",
+        blocked_urls=(),
+        spare_drivers=1,
+        max_driver_uses=100,
+        max_driver_rss=None,
+        media_api_url=SYNDICATION_URL,
+    ):
+        self.pool = DriverPool(pool_size, spares=spare_drivers, max_uses=max_driver_uses, max_rss=max_driver_rss)
+        self.downloader = MediaDownloader(max_workers=4 * pool_size)
+        # Media only captures skip the browser when the embed endpoint knows the tweet
+        self.resolver = MediaResolver(media_api_url) if media_api_url else None
         self.set_mode(mode)
         self.set_night_mode(night_mode)
         self.set_wait_time(wait_time)
+        self.set_block_profile(block_profile, blocked_urls)
+        self.set_screenshot_format("png")
+
+    async def start(self):
+        """Launches the browsers up front, so the first capture doesn't wait for them"""
+        await self.pool.start()
+
+    async def stop(self):
+        """Quits the browsers and closes the HTTP client while the event loop still runs, `quit` closes the rest"""
+        await self.pool.stop()
+        if self.resolver is not None:
+            await self.resolver.close()
 
     async def capture(self, url, path, media_path, mode=None, night_mode=None, only_screenshot=False, only_media=False):
-        async with self.driver_lock:
-            if not self.__driver_alive(self.driver):
-                try:
-                    driver.quit()
-                except Exception as e:
-                    pass
-                finally:
-                    driver = None
-
-            if self.driver is None:
-                self.driver = await get_driver(self.driver_path)
-            driver = self.driver
-            tweet_info = []
+        """
+        Captures the tweet on a free driver of the pool
+
+        All Selenium and HTTP work is blocking, so it runs in the pool's thread
+        executor and the event loop stays free while the tweet is processed.
+        Media only captures are fetched from the embed endpoint first and only
+        fall back to a driver if that fails.
+        """
+        try:
+            with STAGE_SECONDS.time(stage="capture"):
+                if only_media and self.resolver is not None:
+                    tweet_info = await self.__capture_media(url, media_path)
+                    if tweet_info is not None:
+                        return tweet_info
+                async with self.pool.driver() as driver:
+                    return await self.pool.run(
+                        self.__capture,
+                        driver,
+                        url,
+                        path,
+                        media_path,
+                        mode,
+                        night_mode,
+                        only_screenshot,
+                        only_media,
+                    )
+        except BasicExceptionTC as err:
+            FAILURES.inc(exception=type(err).__name__)
+            raise
+
+    async def __capture_media(self, url, media_path):
+        tweet_id = re.search(r"/status(?:es)?/(\d+)", url)
+        if tweet_id is None:
+            return None
+        with STAGE_SECONDS.time(stage="media_api"):
+            tweet_info = await self.resolver.capture_media(tweet_id[1], media_path)
+        if tweet_info is None:
+            logger.info(f"Falling back to the browser for the media of {url}")
+        return tweet_info
+
+    def __capture(self, driver, url, path, media_path, mode, night_mode, only_screenshot, only_media):
+        tweet_info = []
+        try:
+            clear_network_log(driver)
+            block_urls(driver, self.blocked_urls)
+            set_cookies(
+                driver, {"night_mode": self.night_mode if night_mode is None else night_mode}
+            )
             try:
-                driver.get(url)
-                driver.add_cookie(
-                    {
-                        "name": "night_mode",
-                        "value": str(self.night_mode if night_mode is None else night_mode),
-                    }
-                )
-                driver.get(url)
-
-                try:
-                    tweet = WebDriverWait(driver, self.wait_time).until(
-                        EC.presence_of_element_located((By.XPATH, "//article[@data-testid='tweet']"))
+                with STAGE_SECONDS.time(stage="page_load"):
+                    driver.get(url)
+                    tweet = wait_for_tweet(driver, self.wait_time)
+            except TimeoutException as err:
+                raise TimeoutExceptionTC(
+                    f"Tweet wasn't uploaded in {self.wait_time} seconds", url=url
+                ) from err
+
+            with STAGE_SECONDS.time(stage="prepare"):
+                page = prepare_page(driver, tweet, self.mode if mode is None else mode)
+            if page["verified"]:
+                tweet_info.append("TB")
+
+            photos = []
+            photos_start = time.perf_counter()
+            if not only_screenshot:
+                # Photos are downloaded in the background while the screenshot is taken
+                photos = self.__get_photos(page["photos"], media_path)
+
+            if not only_media:
+                with STAGE_SECONDS.time(stage="screenshot"):
+                    screenshot_element(
+                        driver,
+                        tweet,
+                        f"{path}/screenshot",
+                        self.screenshot_format,
+                        self.screenshot_quality,
+                        self.screenshot_max_bytes,
                     )
 
-                    self.__init_scale_css(driver)
-
-                    self.__hide_global_items(driver)
-                    driver.execute_script(
-                        "!!document.activeElement ? document.activeElement.blur() : 0"
+            network_events = read_network_events(driver)
+            stats = network_stats(network_events)
+            logger.info(
+                f"Loaded {url}: {stats['requests']} requests, {stats['bytes']} bytes, {stats['blocked']} blocked"
+            )
+
+            if not only_screenshot and page["videos"] > 0:
+                with STAGE_SECONDS.time(stage="videos"):
+                    get_videos(
+                        driver,
+                        url,
+                        media_path,
+                        self.wait_time,
+                        self.downloader,
+                        network_events=network_events,
                     )
 
-                except TimeoutException as err:
-                    raise TimeoutExceptionTC(
-                        f"Tweet wasn't uploaded in {self.wait_time} seconds", url=url
-                    ) from err
-                self.__code_main_footer_items_new(
-                    tweet, self.mode if mode is None else mode
-                )
-                self.__margin_tweet(self.mode if mode is None else mode, tweet)
-                driver.execute_script("window.scrollTo(0, 0);")
-                if tweet.find_elements(By.CSS_SELECTOR, "svg[data-testid='icon-verified']"):
-                    tweet_info.append("TB")
-
-                if not only_media:
-                    tweet.screenshot(f"{path}/screenshot.png")            
-                
-                tweet_media = tweet.find_elements(By.XPATH, "//article//div[@data-testid='tweetPhoto' and not(ancestor::div[@role='link'])]/img")
-                tweet_video = tweet.find_elements(By.XPATH, "//article//div[@data-testid='videoComponent' and not(ancestor::div[@role='link'])]")
-                
-                if not only_screenshot and (len(tweet_media) > 0 or len(tweet_video) > 0):
-                    self.__get_photos(tweet_media, media_path)
-                    
-                    if len(tweet_video) > 0:
-                        get_videos(driver, url, media_path, self.wait_time)
-
-            except BasicExceptionTC as err:
-                raise err
-            except Exception as err:
-                raise BasicExceptionTC() from err
-            return tweet_info
-
-    def __driver_alive(self, driver):
-        if driver is not None:
-            try:
-                driver.title
-                return True
-            except (InvalidSessionIdException, WebDriverException):
-                return False
-        return False
-
-    def __get_photos(self, tweet_media, media_path):
-        for i, el in enumerate(tweet_media):
-            src = el.get_attribute("src")
+            if photos:
+                for photo in photos:
+                    photo.result()
+                STAGE_SECONDS.observe(time.perf_counter() - photos_start, stage="photos")
+
+        except BasicExceptionTC as err:
+            raise err
+        except Exception as err:
+            raise BasicExceptionTC() from err
+        return tweet_info
+
+    def __get_photos(self, sources, media_path):
+        photos = []
+        for i, src in enumerate(sources):
             src = re.sub("(?<=&name=)small", "large", src)
-            img_data = requests.get(src).content
-            with open(f"{media_path}/image_{i}.png", "wb") as image:
-                image.write(img_data)
+            photos.append(self.downloader.submit(src, f"{media_path}/image_{i}"))
+        return photos
 
     def set_wait_time(self, time):
         if 1.0 <= time <= 30.0:
@@ -114,81 +183,31 @@ class TweetCapture:
         if 0 <= night_mode <= 2:
             self.night_mode = night_mode
 
+    def set_block_profile(self, profile, extra_urls=()):
+        """
+        Selects the urls the browser never loads, see `network_tc.BLOCK_PROFILES`
+
+        Unknown profiles fall back to the default one.
+        """
+        self.blocked_urls = BLOCK_PROFILES.get(profile, BLOCK_PROFILES["default"]) + list(extra_urls)
+
+    def set_screenshot_format(self, image_format, quality=90, max_bytes=None):
+        """
+        Selects the screenshot encoding: png, jpeg or webp
+
+        `quality` (1-100) and the `max_bytes` budget only apply to jpeg and webp.
+        """
+        if image_format in SCREENSHOT_EXTENSIONS and 1 <= quality <= 100:
+            self.screenshot_format = image_format
+            self.screenshot_quality = quality
+            self.screenshot_max_bytes = max_bytes
+
     def set_mode(self, mode):
         self.mode = mode
 
     def set_webdriver_path(self, path):
-        self.driver_path = path
-
-    def __init_scale_css(self, driver):  # .r-rthrr5 { width: 100% !important; } idk twitter removed it
-        driver.execute_script(
-            """
-            var style = document.createElement('style');
-            style.innerHTML = ".r-1ye8kvj { max-width: 40rem !important; } body { scale: 1 !important; transform-origin: 0 0 !important; }";
-            document.head.appendChild(style);
-        """
-        )
-
-    def __hide_global_items(self, driver):
-        HIDE_ITEMS_XPATH = [
-            "/html/body/div/div/div/div[1]",
-            "/html/body/div/div/div/div[2]/header",
-            "/html/body/div/div/div/div[2]/main/div/div/div/div/div/div[1]",
-            "//div[@data-testid='BottomBar' and contains(@style,'transition-property')]",
-            "(//ancestor::div[@dir = 'ltr'])"
-            "//article[@data-testid='tweet']//button[contains(@aria-label,'Grok')]",
-            "//article[@data-testid='tweet']//a[@data-testid='logged_out_read_replies_pivot']",
-        ]
-        for item in HIDE_ITEMS_XPATH:
-            try:
-                element = driver.find_element(By.XPATH, item)
-                driver.execute_script(
-                    """
-                arguments[0].style.display="none";
-                """,
-                    element,
-                )
-            except:
-                continue
-
-    def __margin_tweet(self, mode, base):
-        if mode == 0 or mode == 1:
-            try:
-                base.parent.execute_script(
-                    """arguments[0].childNodes[0].style.paddingBottom = '35px';""",
-                    base.find_element(By.TAG_NAME, "article"),
-                )
-            except:
-                pass
-
-    def __code_main_footer_items_new(self, element, mode):
-        XPATHS = [
-            "((//ancestor::time)/..)[contains(@aria-describedby, 'id__')]",  # date
-            "//div[contains(@role, 'group')][not(contains(@id, 'id__'))]",  # date 2????
-            "//div[contains(@role, 'group')][contains(@id, 'id__')]",  # likes/replies/reply
-        ]
-        hides = []
-        if mode == 0:
-            hides = [0, 1, 2]
-        elif mode == 1:
-            hides = [0, 2]
-        elif mode == 2:
-            hides = [2]
-        elif mode == 3:
-            hides = []
-
-        for i in hides:
-            els = element.find_elements(By.XPATH, XPATHS[i])
-            if len(els) > 0:
-                for el in els:
-                    element.parent.execute_script(
-                        """
-                    arguments[0].style.display="none";
-                    """,
-                        el,
-                    )
-
+        self.pool.driver_path = path
 
     def quit(self):
-        if self.driver is not None:
-            self.driver.quit()
+        self.pool.close()
+        self.downloader.close()
@@ -1,19 +1,48 @@
-import requests
+import re
+
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
 
+from .download_tc import MediaDownloader
 from .exceptions_tc import TimeoutExceptionTC
 from .logger_config import get_logger
+from .network_tc import find_video_variants
 
 logger = get_logger(__name__)
 
 download_endpoint = "https://twtube.app/en/"
 
 
-def get_videos(driver, url, media_path, wait_time=15):
+def get_videos(driver, url, media_path, wait_time=15, downloader=None, network_events=None):
+    """
+    Downloads gifs and videos from a tweet
+
+    The video urls are first looked up in `network_events`, the API answers the
+    tweet page has already loaded (see `network_tc.read_network_events`), so no
+    extra page is opened. If nothing is found there, the twtube site is used.
+    """
+    if downloader is None:
+        downloader = MediaDownloader()
+    if network_events:
+        tweet_id = re.search(r"/status(?:es)?/(\d+)", url)
+        videos = find_video_variants(driver, network_events, tweet_id[1]) if tweet_id else []
+        if videos:
+            logger.info(f"Found {len(videos)} videos in the page traffic")
+            futures = [
+                downloader.submit(video_url, f"{media_path}/video_{i}", ".mp4")
+                for i, (video_url, _) in enumerate(videos)
+            ]
+            for future in futures:
+                future.result()
+            return
+        logger.info("No videos in the page traffic, falling back to twtube")
+    get_videos_twtube(driver, url, media_path, wait_time, downloader)
+
+
+def get_videos_twtube(driver, url, media_path, wait_time, downloader):
     f"""
     Downloads gifs and videos from a tweet using the {download_endpoint} site
 
@@ -56,15 +85,14 @@ def get_videos(driver, url, media_path, wait_time=15):
             f"The video upload site didn't process the tweet in {2*wait_time} seconds", download_endpoint
         ) from err
     logger.info(f"Started downloading videos")
+    videos = []
     for i, button in enumerate(download_buttons):
         if "gif" in button.text.lower():
-            extension = "gif"
+            extension = ".gif"
         else: 
-            extension = "mp4"
+            extension = ".mp4"
             
         video_url = button.find_element(By.XPATH, "..").get_attribute("href")
-
-        with requests.get(video_url, stream=True) as response:
-            with open(f"{media_path}/video_{i}.{extension}", "wb") as video:
-                for chunk in response.iter_content(chunk_size=8 * 1024):
-                    video.write(chunk)
+        videos.append(downloader.submit(video_url, f"{media_path}/video_{i}", extension))
+    for video in videos:
+        video.result()
@@ -1,3 +1,4 @@
+import asyncio
 import tempfile
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
@@ -6,13 +7,20 @@ from webdriver_manager.chrome import ChromeDriverManager
 from os.path import exists
 from os import environ
 from math import ceil
+from functools import partial
 
 from .exceptions_tc import WebdriverExceptionTC
 from .logger_config import get_logger
 
 logger = get_logger(__name__)
 
-async def get_driver(driver_path=None, gui=False, scale=1.0):
+async def get_driver(driver_path=None, gui=False, scale=1.0, executor=None):
+    """
+    Launches a headless Chrome
+
+    Starting a browser takes seconds, so it is done in `executor`
+    (the default executor of the running loop if not given).
+    """
     logger.info("Started launching the driver")
     chrome_options = Options()
     if scale < 1.0:
@@ -30,14 +38,21 @@ async def get_driver(driver_path=None, gui=False, scale=1.0):
     )
 
     chrome_options.add_experimental_option("excludeSwitches", ["enable-logging"])
+    # DevTools network events, used to find video urls in the page's own traffic
+    chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
 
     # driver_path argument : priority 2
     driver_path = "/usr/local/bin/chromedriver"
     chrome_options.binary_location = "/usr/local/bin/chrome"
     
     try:
-        driver = webdriver.Chrome(
-            service=Service(executable_path=driver_path), options=chrome_options
+        driver = await asyncio.get_running_loop().run_in_executor(
+            executor,
+            partial(
+                webdriver.Chrome,
+                service=Service(executable_path=driver_path),
+                options=chrome_options,
+            ),
         )
         logger.info("Driver is running")
         return driver